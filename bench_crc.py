@@ -0,0 +1,42 @@
+import argparse
+import timeit
+
+import numpy as np
+
+import crc
+
+SIZES = [1, 2, 4, 8, 16, 32, 64, 128, 192, 255]
+
+def time_per_call(fn, data, number):
+    timer = timeit.Timer(lambda: fn(data))
+    return min(timer.repeat(repeat=5, number=number)) / number
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare CRC16 implementations across payload sizes")
+    parser.add_argument("-n", "--number", help="calls per timing sample", type=int, default=2000)
+    parser.add_argument("-b", "--batch", help="frames per NumPy batch", type=int, default=1000)
+    args = parser.parse_args()
+
+    # Every engine must match the original table walk before it is timed
+    for name, engine in crc.CRC_ENGINES.items():
+        if not crc.verify_engine(engine):
+            raise SystemExit("CRC engine '{}' does not match the reference table".format(name))
+    rng = np.random.default_rng(1)
+    frames = [rng.integers(0, 256, rng.integers(0, 256), dtype=np.uint8).tobytes() for _ in range(500)]
+    if list(crc.crc16_batch(frames)) != [crc.crc16_table(f) for f in frames]:
+        raise SystemExit("CRC engine 'batch' does not match the reference table")
+    print("All engines verified bit-exact against crc16_tab")
+
+    names = list(crc.CRC_ENGINES) + ['batch']
+    print("{:>5} ".format("bytes") + "".join("{:>12}".format(name) for name in names) + "   (ns per frame)")
+    for size in SIZES:
+        data = rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+        row = []
+        for name, engine in crc.CRC_ENGINES.items():
+            row.append(time_per_call(engine, data, args.number))
+        batch = [data] * args.batch
+        row.append(time_per_call(crc.crc16_batch, batch, max(1, args.number // args.batch)) / args.batch)
+        print("{:>5} ".format(size) + "".join("{:>12.0f}".format(t * 1e9) for t in row))
+
+if __name__ == "__main__":
+    main()
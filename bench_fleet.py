@@ -0,0 +1,119 @@
+import argparse
+import json
+import multiprocessing
+import os
+import selectors
+import statistics
+import threading
+import time
+from collections import deque
+
+from fleet import Fleet, PtyLink, SimulatedDevice
+from poller import percentile
+from protocol import FrameDecoder, encode_frame
+
+POLLS = [bytes(encode_frame(b'\x04')), bytes(encode_frame(b'\x24\x65\x18'))]
+
+def poller(names, rate, duration, results):
+    # Synthetic LCMs: each device is polled `rate` times per second,
+    # alternating COMM_GET_VALUES and the float package poll
+    import tty
+    fds = []
+    for name in names:
+        fd = os.open(name, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+        tty.setraw(fd)
+        fds.append(fd)
+    selector = selectors.DefaultSelector()
+    for index, fd in enumerate(fds):
+        selector.register(fd, selectors.EVENT_READ, index)
+    decoders = [FrameDecoder() for _ in fds]
+    pending = [deque() for _ in fds]
+    latencies = []
+    sent = 0
+    received = 0
+
+    period = 1.0 / rate
+    start = time.monotonic() + 0.1
+    # Spread the devices across the poll period instead of bursting
+    next_send = [start + period * index / len(fds) for index in range(len(fds))]
+    end = start + duration
+    while True:
+        now = time.monotonic()
+        if now >= end:
+            break
+        for index, fd in enumerate(fds):
+            if now >= next_send[index]:
+                os.write(fd, POLLS[sent & 1])
+                pending[index].append(now)
+                sent += 1
+                next_send[index] += period
+        timeout = max(0.0, min(next_send) - time.monotonic())
+        for key, _ in selector.select(timeout):
+            index = key.data
+            try:
+                data = os.read(key.fd, 4096)
+            except BlockingIOError:
+                continue
+            now = time.monotonic()
+            for _ in decoders[index].feed(data):
+                if pending[index]:
+                    latencies.append(now - pending[index].popleft())
+                received += 1
+    for fd in fds:
+        os.close(fd)
+    results.put({"sent": sent, "received": received, "latencies": latencies})
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark many simulated devices in one process")
+    parser.add_argument("-n", "--devices", help="number of simulated devices", type=int, default=100)
+    parser.add_argument("-r", "--rate", help="polls per second per device", type=int, default=100)
+    parser.add_argument("-d", "--duration", help="seconds to run", type=float, default=10.0)
+    parser.add_argument("--json", help="print the results as JSON", action="store_true", default=False)
+    args = parser.parse_args()
+
+    fleet = Fleet()
+    for _ in range(args.devices):
+        device = fleet.add(SimulatedDevice(PtyLink()))
+        device.model.rpm_tick_enabled = True
+        device.model.voltage_tick_enabled = True
+    names = [device.link.slave_name for device in fleet.devices]
+
+    fleet_thread = threading.Thread(target=fleet.run)
+    fleet_thread.start()
+
+    results = multiprocessing.Queue()
+    process = multiprocessing.Process(target=poller, args=(names, args.rate, args.duration, results))
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    process.start()
+    result = results.get()
+    process.join()
+    cpu = time.process_time() - cpu_start
+    wall = time.monotonic() - wall_start
+
+    fleet.stop()
+    fleet_thread.join()
+    fleet.close()
+
+    latencies = sorted(result["latencies"])
+    report = {
+        "devices": args.devices,
+        "rate_per_device": args.rate,
+        "duration": args.duration,
+        "polls_sent": result["sent"],
+        "replies_received": result["received"],
+        "replies_per_second": result["received"] / args.duration,
+        "target_per_second": args.devices * args.rate,
+        "latency_p50_ms": statistics.median(latencies) * 1000 if latencies else None,
+        "latency_p99_ms": percentile(latencies, 0.99) * 1000 if latencies else None,
+        "latency_max_ms": latencies[-1] * 1000 if latencies else None,
+        "simulator_cpu_percent": 100.0 * cpu / wall,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        for key, value in report.items():
+            print("{:>22}: {}".format(key, round(value, 3) if isinstance(value, float) else value))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import time
+import tty
+
+from poller import Poller, percentile
+from protocol import encode_frame
+
+COMMANDS = {
+    "04": b'\x04',
+    "24-65-18": b'\x24\x65\x18',
+}
+BAUD_RATES = [115200, 460800, 921600]
+# Extra request bytes after the command; the handlers ignore them, but the
+# decoder and CRC have to get through them
+PADDING = [0, 64, 200]
+# Start, stop and 8 data bits
+BITS_PER_BYTE = 10
+SIMULATOR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "simulator.py")
+
+def start_simulator(port, baud, extra):
+    process = subprocess.Popen([sys.executable, SIMULATOR, "--headless", "-p", port, "-b", str(baud)] + extra,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return process
+
+def stop_simulator(process):
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def measure(poller, name, payload, baud, padding, duration, depth):
+    request = bytes(encode_frame(payload + bytes(padding)))
+    latencies, reply_size, lost = poller.run(request, duration, depth)
+    latencies.sort()
+    # A pty moves bytes instantly whatever the baud rate, so the time the
+    # bytes would spend on a real line is reported alongside
+    wire_time = (len(request) + reply_size) * BITS_PER_BYTE / baud
+    result = {
+        "command": name,
+        "baud": baud,
+        "request_bytes": len(request),
+        "reply_bytes": reply_size,
+        "depth": depth,
+        "polls": len(latencies),
+        "lost": lost,
+        "polls_per_second": len(latencies) / duration,
+        "wire_limit_polls_per_second": 1.0 / wire_time,
+    }
+    if latencies:
+        result.update({
+            "rtt_p50_us": statistics.median(latencies) * 1e6,
+            "rtt_p99_us": percentile(latencies, 0.99) * 1e6,
+            "rtt_max_us": latencies[-1] * 1e6,
+            "wire_rtt_p50_us": (statistics.median(latencies) + wire_time) * 1e6,
+        })
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the simulator against a synthetic LCM over a pty")
+    parser.add_argument("-d", "--duration", help="seconds per measurement", type=float, default=2.0)
+    parser.add_argument("--baud", help="baud rates to test", type=int, nargs="+", default=BAUD_RATES)
+    parser.add_argument("--padding", help="extra request payload sizes to test", type=int, nargs="+", default=PADDING)
+    parser.add_argument("--depth", help="polls in flight at once", type=int, default=1)
+    parser.add_argument("-o", "--output", help="write the JSON here instead of stdout", default=None)
+    parser.add_argument("simulator_args", nargs="*", help="extra simulator options, after --")
+    args = parser.parse_args()
+
+    master, slave = os.openpty()
+    tty.setraw(master)
+    tty.setraw(slave)
+    port = os.ttyname(slave)
+    poller = Poller(master)
+
+    results = []
+    for baud in args.baud:
+        process = start_simulator(port, baud, args.simulator_args)
+        try:
+            # Wait for the simulator to open the port and answer
+            deadline = time.monotonic() + 10.0
+            while poller.poll(bytes(encode_frame(COMMANDS["04"])), 0.2) is None:
+                if time.monotonic() > deadline or process.poll() is not None:
+                    raise SystemExit("Simulator did not answer on {}".format(port))
+            for name, payload in COMMANDS.items():
+                for padding in args.padding:
+                    result = measure(poller, name, payload, baud, padding, args.duration, args.depth)
+                    results.append(result)
+                    print("{:>9} {:>7} baud {:>4} B request: {:8.0f} polls/s, p50 {:6.0f} us".format(
+                        name, baud, result["request_bytes"], result["polls_per_second"],
+                        result.get("rtt_p50_us", float("nan"))), file=sys.stderr)
+        finally:
+            stop_simulator(process)
+    os.close(master)
+    os.close(slave)
+
+    report = {
+        "python": sys.version.split()[0],
+        "duration": args.duration,
+        "simulator_args": args.simulator_args,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
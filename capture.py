@@ -0,0 +1,203 @@
+import argparse
+import mmap
+import struct
+import threading
+import time
+
+from commands import COMM_CUSTOM_APP_DATA, COMM_GET_VALUES, FLOAT_COMMAND_LCM_POLL, FLOAT_PACKAGE_ID
+from protocol import FRAME_OVERHEAD, encode_frame
+
+# File header, then one record per frame: monotonic timestamp, direction and
+# payload length, followed by the payload itself (framing is not stored)
+MAGIC = b'VESCCAP1'
+RECORD = struct.Struct('<dBH')
+INBOUND = 0
+OUTBOUND = 1
+RAW = 2         # outbound bytes exactly as written, e.g. fuzzed frames
+
+class CaptureWriter:
+    def __init__(self, path, buffering=1 << 16):
+        self.file = open(path, 'wb', buffering=buffering)
+        self.file.write(MAGIC)
+        self.lock = threading.Lock()
+        self.records = 0
+
+    def record(self, direction, payload, timestamp=None):
+        if timestamp is None:
+            timestamp = time.monotonic()
+        header = RECORD.pack(timestamp, direction, len(payload))
+        # Several transports may share one capture
+        with self.lock:
+            self.file.write(header)
+            self.file.write(payload)
+            self.records += 1
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+class CaptureReader:
+    # Iterates a capture through a memory map, so the size of the log does
+    # not matter; payloads are memoryviews into the map, not copies
+    def __init__(self, path):
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[:len(MAGIC)] != MAGIC:
+            self.close()
+            raise ValueError("{} is not a capture file".format(path))
+
+    def __iter__(self):
+        view = memoryview(self.map)
+        size = len(view)
+        offset = len(MAGIC)
+        try:
+            while offset + RECORD.size <= size:
+                timestamp, direction, length = RECORD.unpack_from(view, offset)
+                offset += RECORD.size
+                if offset + length > size:
+                    break  # truncated last record, e.g. the capture was killed
+                yield timestamp, direction, view[offset:offset + length]
+                offset += length
+        finally:
+            view.release()
+
+    def close(self):
+        if not self.map.closed:
+            self.map.close()
+        self.file.close()
+
+class CapturingDispatcher:
+    # Wraps a dispatcher and records every request and reply payload. With
+    # `raw` the replies are recorded byte for byte as RAW instead, for
+    # replies that may not be valid frames (e.g. a FuzzingDispatcher inside
+    # this one), so `capture.py raw` sends exactly what the LCM received.
+    def __init__(self, dispatcher, writer, raw=False):
+        self.dispatcher = dispatcher
+        self.writer = writer
+        self.raw = raw
+
+    def dispatch(self, model, frame):
+        self.writer.record(INBOUND, frame)
+        reply = self.dispatcher.dispatch(model, frame)
+        if reply:
+            if self.raw:
+                self.writer.record(RAW, reply)
+            else:
+                self.writer.record(OUTBOUND, memoryview(reply)[2:len(reply) - 3])
+        return reply
+
+def paced(records, speed=1.0, stop_event=None):
+    # Yield records at their original spacing divided by `speed`; a speed of
+    # 0 replays as fast as possible
+    start = None
+    for timestamp, direction, payload in records:
+        if stop_event is not None and stop_event.is_set():
+            return
+        if speed > 0:
+            if start is None:
+                start = (timestamp, time.monotonic())
+            delay = start[1] + (timestamp - start[0]) / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        yield timestamp, direction, payload
+
+def apply_reply(model, payload):
+    # Load a captured reply into the model so polls see the recorded state
+    with model.update():
+        if payload[0] == COMM_GET_VALUES and len(payload) >= model.values.PAYLOAD.size:
+            model.values.update_from(payload)
+            model.sync_from_packets()
+        elif (payload[0] == COMM_CUSTOM_APP_DATA and len(payload) >= model.lcm_poll_response.PAYLOAD.size
+                and payload[1] == FLOAT_PACKAGE_ID and payload[2] == FLOAT_COMMAND_LCM_POLL):
+            model.lcm_poll_response.update_from(payload)
+
+def replay_state(reader, model, speed=1.0, stop_event=None):
+    # Drive the model from the recorded replies; the sweeps and the
+    # drivetrain would fight them
+    model.stop_profile()
+    model.rpm_tick_enabled = False
+    model.voltage_tick_enabled = False
+    model.physics_enabled = False
+    for _, direction, payload in paced(reader, speed, stop_event):
+        if direction == OUTBOUND and payload:
+            apply_reply(model, payload)
+
+def replay_inbound(reader, link, speed=1.0, stop_event=None):
+    # Re-send the recorded requests, acting as the LCM
+    for _, direction, payload in paced(reader, speed, stop_event):
+        if direction == INBOUND:
+            link.write(encode_frame(payload))
+            link.read()
+
+def replay_raw(reader, link, speed=1.0, stop_event=None):
+    # Write the recorded raw bytes as they were sent, e.g. to reproduce a
+    # fuzzing crash against a real LCM
+    for _, direction, payload in paced(reader, speed, stop_event):
+        if direction == RAW:
+            link.write(payload)
+            link.read()
+
+def info(reader):
+    counts = [0, 0, 0]
+    sizes = [0, 0, 0]
+    first = last = None
+    for timestamp, direction, payload in reader:
+        counts[direction] += 1
+        sizes[direction] += len(payload) + (FRAME_OVERHEAD if direction != RAW else 0)
+        first = timestamp if first is None else first
+        last = timestamp
+    duration = (last - first) if first is not None else 0.0
+    print("{} inbound frames ({} bytes), {} outbound frames ({} bytes) over {:.3f} s".format(
+        counts[INBOUND], sizes[INBOUND], counts[OUTBOUND], sizes[OUTBOUND], duration))
+    if counts[RAW]:
+        print("{} raw writes ({} bytes)".format(counts[RAW], sizes[RAW]))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Inspect and replay serial captures")
+    parser.add_argument("mode", choices=["info", "state", "inbound", "raw"],
+                        help="info: summarise; state: serve a device driven by the recorded replies; "
+                             "inbound: re-send the recorded requests to a device; "
+                             "raw: re-send the recorded raw writes, e.g. a fuzzing crash")
+    parser.add_argument("capture", help="capture file written with --capture")
+    parser.add_argument("-p", "--port", help="serial port to serve or to send to")
+    parser.add_argument("--pty", help="serve the replayed device on a new pty",
+                        action="store_true", default=False)
+    parser.add_argument("-s", "--speed", help="replay speed factor, 0 for as fast as possible",
+                        type=float, default=1.0)
+    args = parser.parse_args(argv)
+
+    from fleet import Fleet, PtyLink, SerialLink, SimulatedDevice
+
+    reader = CaptureReader(args.capture)
+    try:
+        if args.mode == "info":
+            info(reader)
+        elif args.mode in ("inbound", "raw"):
+            link = SerialLink(args.port)
+            try:
+                if args.mode == "inbound":
+                    replay_inbound(reader, link, args.speed)
+                else:
+                    replay_raw(reader, link, args.speed)
+            finally:
+                link.close()
+        else:
+            fleet = Fleet()
+            link = PtyLink() if args.pty else SerialLink(args.port)
+            device = fleet.add(SimulatedDevice(link))
+            print(link.name)
+            fleet_thread = threading.Thread(target=fleet.run)
+            fleet_thread.start()
+            try:
+                replay_state(reader, device.model, args.speed)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                fleet.stop()
+                fleet_thread.join()
+                fleet.close()
+    finally:
+        reader.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import struct
+from dataclasses import dataclass
+from typing import Optional
+
+# VESC command ids
+COMM_GET_VALUES = 0x04
+COMM_CUSTOM_APP_DATA = 0x24
+
+# Float package commands, sent as COMM_CUSTOM_APP_DATA with this app id
+FLOAT_PACKAGE_ID = 0x65
+FLOAT_COMMAND_LCM_POLL = 0x18
+FLOAT_COMMAND_CHARGESTATE = 0x1c
+FLOAT_COMMAND_LCM_DEBUG = 0x63
+
+# Charge state message: magic byte, charging flag, current and voltage x10
+CHARGESTATE_MAGIC = 151
+CHARGESTATE = struct.Struct('>BBhh')
+
+# Typed requests from the LCM. The decoders read straight out of the frame
+# (bytes or a memoryview into the receive buffer) with unpack_from, so
+# nothing is copied on the way to the typed object.
+
+@dataclass
+class GetValues:
+    pass
+
+@dataclass
+class LcmPoll:
+    pass
+
+@dataclass
+class ChargeState:
+    charging: bool
+    current: float
+    voltage: float
+
+@dataclass
+class LcmDebug:
+    text: str
+
+@dataclass
+class UnknownCommand:
+    command: int
+    app_id: Optional[int] = None
+    float_command: Optional[int] = None
+
+def decode_get_values(frame):
+    return GetValues()
+
+def decode_lcm_poll(frame):
+    return LcmPoll()
+
+def decode_charge_state(frame):
+    if len(frame) < 3 + CHARGESTATE.size:
+        raise ValueError("Short FLOAT_COMMAND_CHARGESTATE")
+    magic, charging, current, voltage = CHARGESTATE.unpack_from(frame, 3)
+    if magic != CHARGESTATE_MAGIC:
+        raise ValueError("Bad FLOAT_COMMAND_CHARGESTATE magic: {}".format(magic))
+    return ChargeState(charging > 0, current / 10, voltage / 10)
+
+def decode_lcm_debug(frame):
+    return LcmDebug(str(frame[3:], 'ascii', errors='replace'))
+
+# Keyed like the dispatcher: (command,), (command, app id) or
+# (command, app id, float command)
+DECODERS = {
+    (COMM_GET_VALUES,): decode_get_values,
+    (COMM_CUSTOM_APP_DATA, FLOAT_PACKAGE_ID, FLOAT_COMMAND_LCM_POLL): decode_lcm_poll,
+    (COMM_CUSTOM_APP_DATA, FLOAT_PACKAGE_ID, FLOAT_COMMAND_CHARGESTATE): decode_charge_state,
+    (COMM_CUSTOM_APP_DATA, FLOAT_PACKAGE_ID, FLOAT_COMMAND_LCM_DEBUG): decode_lcm_debug,
+}
+
+def decode_command(frame):
+    # Typed object for a request payload; raises ValueError if malformed
+    if not len(frame):
+        raise ValueError("Empty frame")
+    command = frame[0]
+    key = (command,)
+    if command == COMM_CUSTOM_APP_DATA and len(frame) >= 3:
+        key = (command, frame[1], frame[2])
+    decoder = DECODERS.get(key)
+    if decoder is None:
+        return UnknownCommand(*key)
+    return decoder(frame)
@@ -0,0 +1,115 @@
+import binascii
+
+import numpy as np
+
+# CRC Table
+crc16_tab = [
+    0x0000, 0x1021, 0x2042, 0x3063, 0x4084, 0x50a5, 0x60c6, 0x70e7, 0x8108, 0x9129, 0xa14a, 0xb16b, 0xc18c, 0xd1ad,
+    0xe1ce, 0xf1ef, 0x1231, 0x0210, 0x3273, 0x2252, 0x52b5, 0x4294, 0x72f7, 0x62d6, 0x9339, 0x8318, 0xb37b, 0xa35a,
+    0xd3bd, 0xc39c, 0xf3ff, 0xe3de, 0x2462, 0x3443, 0x0420, 0x1401, 0x64e6, 0x74c7, 0x44a4, 0x5485, 0xa56a, 0xb54b,
+    0x8528, 0x9509, 0xe5ee, 0xf5cf, 0xc5ac, 0xd58d, 0x3653, 0x2672, 0x1611, 0x0630, 0x76d7, 0x66f6, 0x5695, 0x46b4,
+    0xb75b, 0xa77a, 0x9719, 0x8738, 0xf7df, 0xe7fe, 0xd79d, 0xc7bc, 0x48c4, 0x58e5, 0x6886, 0x78a7, 0x0840, 0x1861,
+    0x2802, 0x3823, 0xc9cc, 0xd9ed, 0xe98e, 0xf9af, 0x8948, 0x9969, 0xa90a, 0xb92b, 0x5af5, 0x4ad4, 0x7ab7, 0x6a96,
+    0x1a71, 0x0a50, 0x3a33, 0x2a12, 0xdbfd, 0xcbdc, 0xfbbf, 0xeb9e, 0x9b79, 0x8b58, 0xbb3b, 0xab1a, 0x6ca6, 0x7c87,
+    0x4ce4, 0x5cc5, 0x2c22, 0x3c03, 0x0c60, 0x1c41, 0xedae, 0xfd8f, 0xcdec, 0xddcd, 0xad2a, 0xbd0b, 0x8d68, 0x9d49,
+    0x7e97, 0x6eb6, 0x5ed5, 0x4ef4, 0x3e13, 0x2e32, 0x1e51, 0x0e70, 0xff9f, 0xefbe, 0xdfdd, 0xcffc, 0xbf1b, 0xaf3a,
+    0x9f59, 0x8f78, 0x9188, 0x81a9, 0xb1ca, 0xa1eb, 0xd10c, 0xc12d, 0xf14e, 0xe16f, 0x1080, 0x00a1, 0x30c2, 0x20e3,
+    0x5004, 0x4025, 0x7046, 0x6067, 0x83b9, 0x9398, 0xa3fb, 0xb3da, 0xc33d, 0xd31c, 0xe37f, 0xf35e, 0x02b1, 0x1290,
+    0x22f3, 0x32d2, 0x4235, 0x5214, 0x6277, 0x7256, 0xb5ea, 0xa5cb, 0x95a8, 0x8589, 0xf56e, 0xe54f, 0xd52c, 0xc50d,
+    0x34e2, 0x24c3, 0x14a0, 0x0481, 0x7466, 0x6447, 0x5424, 0x4405, 0xa7db, 0xb7fa, 0x8799, 0x97b8, 0xe75f, 0xf77e,
+    0xc71d, 0xd73c, 0x26d3, 0x36f2, 0x0691, 0x16b0, 0x6657, 0x7676, 0x4615, 0x5634, 0xd94c, 0xc96d, 0xf90e, 0xe92f,
+    0x99c8, 0x89e9, 0xb98a, 0xa9ab, 0x5844, 0x4865, 0x7806, 0x6827, 0x18c0, 0x08e1, 0x3882, 0x28a3, 0xcb7d, 0xdb5c,
+    0xeb3f, 0xfb1e, 0x8bf9, 0x9bd8, 0xabbb, 0xbb9a, 0x4a75, 0x5a54, 0x6a37, 0x7a16, 0x0af1, 0x1ad0, 0x2ab3, 0x3a92,
+    0xfd2e, 0xed0f, 0xdd6c, 0xcd4d, 0xbdaa, 0xad8b, 0x9de8, 0x8dc9, 0x7c26, 0x6c07, 0x5c64, 0x4c45, 0x3ca2, 0x2c83,
+    0x1ce0, 0x0cc1, 0xef1f, 0xff3e, 0xcf5d, 0xdf7c, 0xaf9b, 0xbfba, 0x8fd9, 0x9ff8, 0x6e17, 0x7e36, 0x4e55, 0x5e74,
+    0x2e93, 0x3eb2, 0x0ed1, 0x1ef0
+]
+
+def crc16_table(data):
+    cksum = 0
+    for byte in data:
+        cksum = crc16_tab[((cksum >> 8) ^ byte) & 0xFF] ^ (cksum << 8)
+    return cksum & 0xFFFF  # Ensure it stays within 16 bits
+
+def make_slicing_tables(n):
+    # tables[k][x] is the CRC contribution of byte x followed by k zero bytes.
+    # The CRC is linear, so N input bytes can be folded in with N lookups.
+    tables = [list(crc16_tab)]
+    for _ in range(1, n):
+        prev = tables[-1]
+        tables.append([crc16_tab[c >> 8] ^ ((c & 0xFF) << 8) for c in prev])
+    return tables
+
+_t0, _t1, _t2, _t3, _t4, _t5, _t6, _t7 = make_slicing_tables(8)
+
+def crc16_sliced(data):
+    # Slicing-by-8: consume eight bytes per loop iteration
+    t0 = _t0
+    cksum = 0
+    size = len(data)
+    tail = size & 7
+    if size >= 16:
+        t1, t2, t3, t4, t5, t6, t7 = _t1, _t2, _t3, _t4, _t5, _t6, _t7
+        it = iter(data)
+        for b0, b1, b2, b3, b4, b5, b6, b7 in zip(it, it, it, it, it, it, it, it):
+            cksum = (t7[(cksum >> 8) ^ b0] ^ t6[(cksum & 0xFF) ^ b1] ^ t5[b2] ^ t4[b3] ^
+                     t3[b4] ^ t2[b5] ^ t1[b6] ^ t0[b7])
+        # zip() stops at the last full block; pick up the remaining bytes
+        data = data[size - tail:] if tail else b''
+    for byte in data:
+        cksum = t0[(cksum >> 8) ^ byte] ^ ((cksum << 8) & 0xFFFF)
+    return cksum
+
+# binascii.crc_hqx is the same CRC-CCITT (XModem) polynomial, implemented in C
+_crc_hqx = getattr(binascii, 'crc_hqx', None)
+
+def crc16_hqx(data):
+    return _crc_hqx(data, 0)
+
+def crc16_batch(payloads):
+    # Checksum many payloads at once, returning a uint16 array. With a zero
+    # initial value leading zero bytes do not change the CRC, so payloads are
+    # right-aligned in a zero-padded matrix and stepped one column at a time.
+    count = len(payloads)
+    lengths = np.fromiter((len(p) for p in payloads), dtype=np.intp, count=count)
+    width = int(lengths.max()) if count else 0
+    matrix = np.zeros((count, width), dtype=np.uint8)
+    data = np.frombuffer(b''.join(payloads), dtype=np.uint8)
+    if data.size:
+        rows = np.repeat(np.arange(count), lengths)
+        starts = np.cumsum(lengths) - lengths
+        cols = np.arange(data.size) - starts[rows] + (width - lengths)[rows]
+        matrix[rows, cols] = data
+    table = np.array(crc16_tab, dtype=np.uint32)
+    cksum = np.zeros(count, dtype=np.uint32)
+    for column in matrix.T:
+        cksum = table[(cksum >> 8) ^ column] ^ ((cksum << 8) & 0xFFFF)
+    return cksum.astype(np.uint16)
+
+CRC_ENGINES = {
+    'table': crc16_table,
+    'sliced': crc16_sliced,
+}
+if _crc_hqx is not None:
+    CRC_ENGINES['hqx'] = crc16_hqx
+
+# Fastest available engine; callers use crc.crc16 so select_crc_engine()
+# takes effect everywhere
+crc16 = CRC_ENGINES.get('hqx', crc16_sliced)
+
+def select_crc_engine(name):
+    global crc16
+    if name not in CRC_ENGINES:
+        raise ValueError("Unknown CRC engine: {} (available: {})".format(name, ", ".join(CRC_ENGINES)))
+    crc16 = CRC_ENGINES[name]
+    return crc16
+
+def verify_engine(engine, sizes=range(0, 256), seed=0):
+    # Compare an engine against the reference table walk, bit for bit
+    rng = np.random.default_rng(seed)
+    for size in sizes:
+        data = rng.integers(0, 256, size, dtype=np.uint8).tobytes()
+        if engine(data) != crc16_table(data):
+            return False
+    return True
+
@@ -0,0 +1,110 @@
+import importlib
+import time
+
+from commands import (COMM_CUSTOM_APP_DATA, COMM_GET_VALUES, FLOAT_COMMAND_CHARGESTATE,
+                      FLOAT_COMMAND_LCM_DEBUG, FLOAT_COMMAND_LCM_POLL, FLOAT_PACKAGE_ID,
+                      decode_charge_state, decode_lcm_debug)
+
+class Dispatcher:
+    # Maps a request to its handler with one dict lookup per key level.
+    # Keys are (command,), (command, app id) or (command, app id, float
+    # command); the most specific registered key wins. Handlers take
+    # (model, frame) and return the framed reply, or None to send nothing.
+    def __init__(self):
+        self.handlers = {}
+        # Set to a metrics.Metrics to time the lookup and the handler
+        self.metrics = None
+
+    def register(self, handler, command, app_id=None, float_command=None):
+        key = (command,)
+        if app_id is not None:
+            key += (app_id,)
+            if float_command is not None:
+                key += (float_command,)
+        self.handlers[key] = handler
+        return handler
+
+    def handler(self, command, app_id=None, float_command=None):
+        # Decorator form of register()
+        def decorator(handler):
+            return self.register(handler, command, app_id, float_command)
+        return decorator
+
+    def lookup(self, frame):
+        handlers = self.handlers
+        command = frame[0]
+        if command == COMM_CUSTOM_APP_DATA and len(frame) >= 2:
+            if len(frame) >= 3:
+                handler = handlers.get((command, frame[1], frame[2]))
+                if handler is not None:
+                    return handler
+            handler = handlers.get((command, frame[1]))
+            if handler is not None:
+                return handler
+        return handlers.get((command,))
+
+    def dispatch(self, model, frame):
+        if self.metrics is not None:
+            return self.dispatch_timed(model, frame)
+        handler = self.lookup(frame)
+        if handler is None:
+            print("Unknown frame received: 0x{}".format(bytes(frame[:3]).hex()))
+            return None
+        return handler(model, frame)
+
+    def dispatch_timed(self, model, frame):
+        start = time.perf_counter()
+        handler = self.lookup(frame)
+        found = time.perf_counter()
+        if handler is None:
+            print("Unknown frame received: 0x{}".format(bytes(frame[:3]).hex()))
+            reply = None
+        else:
+            reply = handler(model, frame)
+        self.metrics.observe_dispatch(frame, found - start, time.perf_counter() - found)
+        return reply
+
+    def load_plugin(self, name):
+        # A plugin is any importable module with a register(dispatcher) function
+        module = importlib.import_module(name)
+        module.register(self)
+        return module
+
+default_dispatcher = Dispatcher()
+
+@default_dispatcher.handler(COMM_GET_VALUES)
+def get_values(model, frame):
+    return model.snapshot.values_frame()
+
+@default_dispatcher.handler(COMM_CUSTOM_APP_DATA, FLOAT_PACKAGE_ID, FLOAT_COMMAND_LCM_POLL)
+def lcm_poll(model, frame):
+    return model.snapshot.lcm_poll_frame()
+
+@default_dispatcher.handler(COMM_CUSTOM_APP_DATA, FLOAT_PACKAGE_ID, FLOAT_COMMAND_CHARGESTATE)
+def charge_state(model, frame):
+    # The LCM reports charger state; the float package does not reply
+    try:
+        state = decode_charge_state(frame)
+    except ValueError as e:
+        print(e)
+        return None
+    model.charging = state.charging
+    model.charge_current = state.current
+    model.charge_voltage = state.voltage
+    return None
+
+@default_dispatcher.handler(COMM_CUSTOM_APP_DATA, FLOAT_PACKAGE_ID, FLOAT_COMMAND_LCM_DEBUG)
+def lcm_debug(model, frame):
+    model.lcm_debug = decode_lcm_debug(frame).text
+    print("LCM debug: ", model.lcm_debug)
+    return None
+
+@default_dispatcher.handler(COMM_CUSTOM_APP_DATA, FLOAT_PACKAGE_ID)
+def unknown_float_command(model, frame):
+    print("Unknown FLOAT_COMMAND")
+    return None
+
+@default_dispatcher.handler(COMM_CUSTOM_APP_DATA)
+def unknown_custom_app(model, frame):
+    print("Unknown custom app")
+    return None
@@ -0,0 +1,441 @@
+import functools
+import threading
+from contextlib import contextmanager
+from enum import Enum
+
+from packets import COMM_GET_VALUES, COMM_CUSTOM_APP_DATA
+from physics import Drivetrain
+
+class RunState(Enum):
+    STATE_DISABLED = 0
+    STATE_STARTUP = 1
+    STATE_READY = 2
+    STATE_RUNNING = 3
+
+def default_values():
+    return COMM_GET_VALUES(
+        id=0x04,
+        temp_fet=0.0,
+        temp_motor=0.0,
+        avg_motor_current=0.0,
+        avg_input_current=0.0,
+        avg_id=0.0,
+        avg_iq=0.0,
+        duty_cycle_now=0.0,
+        rpm=0.0,
+        voltage_filtered=0.0,
+        amp_hours=0.0,
+        amp_hours_charged=0.0,
+        watt_hours=0.0,
+        watt_hours_charged=0.0,
+        tachometer=0.0,
+        tachometer_abs=0.0,
+        fault=0
+    )
+
+def default_lcm_poll_response():
+    return COMM_CUSTOM_APP_DATA(
+        id = 0x24,
+        floatpkg= 0x65,
+        floatcmd = 0x18,
+        state = RunState.STATE_RUNNING.value,
+        fault = 0,
+        pitch_or_duty_cycle = 0,
+        rpm = 0.0,
+        avgInputCurrent = 0.0,
+        inpVoltage = 0.0,
+        headlightBrightness = 100,
+        headlightIdleBrightness = 100,
+        statusbarBrightness = 100
+    )
+
+# COMM_GET_VALUES fields written from the drivetrain each tick
+DRIVE_VALUES = ("avg_motor_current", "voltage_filtered", "temp_fet", "temp_motor",
+                "amp_hours", "amp_hours_charged", "watt_hours", "watt_hours_charged",
+                "tachometer", "tachometer_abs")
+# and, as a Fleet's sweeps leave it to apply_drive(), the RPM
+APPLIED_VALUES = ("rpm",) + DRIVE_VALUES
+# COMM_GET_VALUES and LCM poll fields written from a ride profile sample
+PROFILE_VALUES = ("rpm", "duty_cycle_now", "avg_input_current") + DRIVE_VALUES
+PROFILE_LCM_POLL = ("rpm", "pitch_or_duty_cycle", "avgInputCurrent", "inpVoltage")
+
+class Snapshot:
+    # One complete, immutable model state as the reply packets' field values,
+    # published by swapping a single reference so readers never need a lock.
+    # Frames are encoded on first use by whichever thread polls, into the
+    # packets' reused reply buffers; that is a pure function of the values,
+    # so racing readers produce the same bytes. Later polls of the same
+    # snapshot are cache hits.
+    __slots__ = ("version", "values", "lcm_poll", "packets", "_values_frame", "_lcm_poll_frame")
+
+    def __init__(self, version, values, lcm_poll, packets):
+        self.version = version
+        self.values = values
+        self.lcm_poll = lcm_poll
+        self.packets = packets      # (COMM_GET_VALUES, COMM_CUSTOM_APP_DATA) owning the buffers
+        self._values_frame = None
+        self._lcm_poll_frame = None
+
+    def values_frame(self):
+        frame = self._values_frame
+        if frame is None:
+            frame = self._values_frame = self.packets[0].frame_values(self.values)
+        else:
+            self.packets[0].cache_stats.hits += 1
+        return frame
+
+    def lcm_poll_frame(self):
+        frame = self._lcm_poll_frame
+        if frame is None:
+            frame = self._lcm_poll_frame = self.packets[1].frame_values(self.lcm_poll)
+        else:
+            self.packets[1].cache_stats.hits += 1
+        return frame
+
+def publishes(method):
+    # Run a mutator as one update; calls nested in an update (e.g. set_rpm
+    # from tick) skip straight to the method
+    # (update() spelled out, as this runs on every tick)
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        ident = threading.get_ident()
+        if self.writer == ident:
+            return method(self, *args, **kwargs)
+        with self.lock:
+            self.writer = ident
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self.writer = None
+                self.publish()
+    return wrapper
+
+class SimulatorModel:
+    # Headless state of one simulated VESC. Owns the reply packets and the
+    # tick logic; the GUI (if any) is only a view onto it.
+    #
+    # The GUI and tick threads change the packets field by field, inside
+    # update(); writers take turns on a lock, and the last one out publishes
+    # a new Snapshot. Readers only ever use `snapshot`, which always holds a
+    # complete state.
+    def __init__(self):
+        self.values = default_values()
+        self.lcm_poll_response = default_lcm_poll_response()
+        self.lock = threading.Lock()
+        self.writer = None      # thread id of the update in progress
+        self.snapshot = None
+        self.snapshot_versions = None
+
+        # Battery - approximate for 15S battery
+        self.min_voltage = 30.0
+        self.max_voltage = 70.0
+        self.voltage = 0.0
+        self.voltage_tick_enabled = False
+        self.voltage_tick_up = False
+        self.voltage_rate = 1.0    # volts per second
+
+        # RPM sweep and the values linked to it
+        self.min_rpm = -900
+        self.max_rpm = 900
+        self.rpm = 0
+        self.rpm_tick_enabled = False
+        self.rpm_tick_up = True
+        self.rpm_rate = 100.0      # RPM per second
+        self.tire_circumference = 32.75
+        self.duty_cycle = 0.0
+        self.duty_cycle_linked = True
+        self.input_current = 0.0
+        self.input_current_linked = True
+
+        # Battery, motor and FETs; duty cycle and input current follow RPM
+        # through it while linked. A Fleet moves the model into one shared,
+        # fleet-wide Drivetrain with use_drive().
+        self.drive = Drivetrain(1)
+        self.drive_index = 0
+        self.drive_stale = False    # a Fleet stepped the drive since apply_drive
+        self.physics_enabled = True
+
+        self.float_enabled = True
+
+        # Precomputed ride profile replacing the sweep while it plays
+        self.profile = None
+        self.profile_time = 0.0
+        self.profile_loop = True
+        self.profile_totals = None  # Drivetrain.TOTALS while a profile plays
+
+        # Reported by the LCM
+        self.charging = False
+        self.charge_current = 0.0
+        self.charge_voltage = 0.0
+        self.lcm_debug = ""
+
+        self.set_voltage(60.0)
+        self.set_rpm(0)
+
+    @contextmanager
+    def update(self):
+        ident = threading.get_ident()
+        if self.writer == ident:
+            yield self
+            return
+        with self.lock:
+            self.writer = ident
+            try:
+                yield self
+            finally:
+                self.writer = None
+                self.publish()
+
+    def publish(self):
+        # Copy out the fields of the packets that changed since the last
+        # snapshot; nothing changed means no new snapshot
+        snapshot = self.snapshot
+        values = self.values
+        lcm_poll_response = self.lcm_poll_response
+        versions = (values.version, lcm_poll_response.version)
+        if snapshot is not None and versions == self.snapshot_versions:
+            return snapshot
+        self.snapshot_versions = versions
+        self.snapshot = Snapshot(
+            snapshot.version + 1 if snapshot is not None else 1,
+            values.field_values(),
+            lcm_poll_response.field_values(),
+            (values, lcm_poll_response))
+        return self.snapshot
+
+    @publishes
+    def set_voltage(self, voltage):
+        # The rest voltage; the reported voltage sags under load. Results
+        # still waiting from a Fleet step come first, or they would undo it.
+        self.sync_drive()
+        self.voltage = voltage
+        self.drive.set_open_circuit(self.drive_index, voltage)
+        self.values.voltage_filtered = voltage
+        self.lcm_poll_response.inpVoltage = voltage
+
+    @publishes
+    def set_duty_cycle(self, duty_cycle):
+        self.duty_cycle = duty_cycle
+        self.values.duty_cycle_now = duty_cycle
+        self.lcm_poll_response.pitch_or_duty_cycle = duty_cycle
+
+    @publishes
+    def set_input_current(self, input_current):
+        self.input_current = input_current
+        self.values.avg_input_current = input_current
+        self.lcm_poll_response.avgInputCurrent = input_current
+
+    @publishes
+    def set_rpm(self, rpm):
+        self.rpm = rpm
+        self.drive.rpm[self.drive_index] = rpm
+        if not self.physics_enabled:
+            # Without the drivetrain, duty cycle and input current follow
+            # RPM linearly as they always have
+            if self.input_current_linked:
+                self.set_input_current(min(abs(rpm) / 200.0, 1.0))
+            if self.duty_cycle_linked:
+                self.set_duty_cycle(min(abs(rpm) / 800.0, 1.0))
+        self.values.rpm = rpm
+        self.lcm_poll_response.rpm = rpm
+
+    @publishes
+    def set_motor_current(self, motor_current):
+        self.values.avg_motor_current = motor_current
+
+    @publishes
+    def set_temperatures(self, temp_fet, temp_motor):
+        self.values.temp_fet = temp_fet
+        self.values.temp_motor = temp_motor
+
+    def use_drive(self, drive, index):
+        # Carry this device's battery, motor and FET state over to slot
+        # `index` of another Drivetrain
+        with self.update():
+            drive.copy_device(index, self.drive, self.drive_index)
+            self.drive = drive
+            self.drive_index = index
+
+    def sync_drive(self):
+        # A Fleet only marks its devices stale when it steps the shared
+        # drivetrain; the results are applied here, when a device is polled
+        if self.drive_stale:
+            self.drive_stale = False
+            self.apply_drive(self.drive.table[:, self.drive_index].tolist())
+
+    @publishes
+    def apply_drive(self, row):
+        # One device's results from Drivetrain.rows()
+        # (the setters spelled out, as this runs on every tick or poll)
+        (duty_cycle, motor_current, input_current, voltage, open_circuit,
+         temp_fet, temp_motor, *totals) = row
+        values = self.values
+        lcm_poll_response = self.lcm_poll_response
+        if self.duty_cycle_linked:
+            self.duty_cycle = duty_cycle
+            values.duty_cycle_now = duty_cycle
+            lcm_poll_response.pitch_or_duty_cycle = duty_cycle
+        if self.input_current_linked:
+            self.input_current = input_current
+            values.avg_input_current = input_current
+            lcm_poll_response.avgInputCurrent = input_current
+        self.voltage = open_circuit
+        lcm_poll_response.rpm = self.rpm
+        lcm_poll_response.inpVoltage = voltage
+        values.assign(APPLIED_VALUES, (self.rpm, motor_current, voltage, temp_fet, temp_motor, *totals))
+
+    @publishes
+    def sync_from_packets(self):
+        # Bring the model in line after the packets were loaded directly,
+        # e.g. from a capture
+        self.rpm = self.values.rpm
+        self.voltage = self.values.voltage_filtered
+        self.duty_cycle = self.values.duty_cycle_now
+        self.input_current = self.values.avg_input_current
+
+    def play_profile(self, profile, loop=True):
+        # The totals carry on from the device's own, adding up the samples
+        # as they are played
+        with self.update():
+            self.profile_totals = [getattr(self.drive, name).item(self.drive_index)
+                                   for name in Drivetrain.TOTALS]
+            self.profile = profile
+            self.profile_time = 0.0
+            self.profile_loop = loop
+
+    def stop_profile(self):
+        self.profile = None
+
+    @publishes
+    def apply_profile_sample(self, index, dt):
+        # The temperatures and totals also go back into the drivetrain, so
+        # it carries on from them when the profile ends
+        # (the setters spelled out, as this runs every tick)
+        profile = self.profile
+        rpm = profile.rpm.item(index)
+        duty_cycle = profile.duty_cycle.item(index)
+        input_current = profile.input_current.item(index)
+        voltage = profile.voltage.item(index)
+        temperatures = (profile.temp_fet.item(index), profile.temp_motor.item(index))
+        self.rpm = rpm
+        self.duty_cycle = duty_cycle
+        self.input_current = input_current
+        self.voltage = voltage
+        drive = self.drive
+        drive.rpm[self.drive_index] = rpm
+        # Charge and energy over this tick, as Drivetrain.step counts them
+        totals = self.profile_totals
+        charge = input_current * (dt / 3600.0)
+        energy = charge * voltage
+        if charge > 0:
+            totals[0] += charge
+            totals[2] += energy
+        else:
+            totals[1] -= charge
+            totals[3] -= energy
+        steps = rpm * (dt / 60.0 * drive.params.tachometer_steps)
+        totals[4] += steps
+        totals[5] += abs(steps)
+        carried = temperatures + tuple(totals)
+        drive.table[Drivetrain.PROFILE_ROWS, self.drive_index] = carried
+        self.values.assign(PROFILE_VALUES, (rpm, duty_cycle, input_current, profile.motor_current.item(index),
+                                            voltage) + carried)
+        self.lcm_poll_response.assign(PROFILE_LCM_POLL, (rpm, duty_cycle, input_current, voltage))
+        if profile.state is not None:
+            self.lcm_poll_response.state = profile.state.item(index)
+        if profile.fault is not None:
+            fault = profile.fault.item(index)
+            self.values.fault = fault
+            self.lcm_poll_response.fault = fault
+
+    @property
+    def speed_mph(self):
+        return (abs(self.rpm) * self.tire_circumference) / 1056   # convert RPM to MPH
+
+    @publishes
+    def set_headlight_brightness(self, value):
+        self.lcm_poll_response.headlightBrightness = int(value)
+
+    @publishes
+    def set_headlight_idle_brightness(self, value):
+        self.lcm_poll_response.headlightIdleBrightness = int(value)
+
+    @publishes
+    def set_statusbar_brightness(self, value):
+        self.lcm_poll_response.statusbarBrightness = int(value)
+
+    def drive_rpm(self, rpm):
+        # set_rpm() for a sweep in a Fleet: only the drivetrain needs it
+        # now, the packets catch up in sync_drive()
+        self.rpm = rpm
+        self.drive.rpm[self.drive_index] = rpm
+
+    def drive_voltage(self, voltage):
+        self.voltage = voltage
+        self.drive.set_open_circuit(self.drive_index, voltage)
+
+    @property
+    def sweeping(self):
+        # Whether tick() has more to do than step the drivetrain
+        return self.profile is not None or self.rpm_tick_enabled or self.voltage_tick_enabled
+
+    @publishes
+    def tick(self, dt=0.01, stepped=False):
+        # Sweep RPM and voltage between their limits at a fixed rate per
+        # second, so the simulated speed does not depend on the tick rate,
+        # then step the drivetrain. A Fleet steps its shared drivetrain
+        # itself and passes `stepped`; the results wait for sync_drive().
+        if self.profile is not None:
+            self.drive_stale = False
+            # A playing profile only needs indexing, all the maths is done
+            profile = self.profile
+            index = int(self.profile_time * profile.rate)
+            if index >= len(profile):
+                if not self.profile_loop:
+                    # The battery carries on from the last voltage
+                    self.profile = None
+                    self.set_voltage(self.voltage)
+                    return
+                index %= len(profile)
+                self.profile_time = index / profile.rate
+            self.apply_profile_sample(index, dt)
+            self.profile_time += dt
+            return
+
+        set_rpm, set_voltage = self.set_rpm, self.set_voltage
+        if stepped and self.physics_enabled:
+            set_rpm, set_voltage = self.drive_rpm, self.drive_voltage
+            # The voltage sweep carries on from where the step left the battery
+            self.voltage = self.drive.open_circuit.item(self.drive_index)
+        if self.rpm_tick_enabled:
+            step = self.rpm_rate * dt
+            if self.rpm_tick_up:
+                if self.rpm < self.max_rpm:
+                    set_rpm(min(self.rpm + step, self.max_rpm))
+                else:
+                    self.rpm_tick_up = False
+            else:
+                if self.rpm > self.min_rpm:
+                    set_rpm(max(self.rpm - step, self.min_rpm))
+                else:
+                    self.rpm_tick_up = True
+
+        if self.voltage_tick_enabled:
+            step = self.voltage_rate * dt
+            if self.voltage_tick_up:
+                if self.voltage < self.max_voltage:
+                    set_voltage(min(self.voltage + step, self.max_voltage))
+                else:
+                    self.voltage_tick_up = False
+            else:
+                if self.voltage > self.min_voltage:
+                    set_voltage(max(self.voltage - step, self.min_voltage))
+                else:
+                    self.voltage_tick_up = True
+
+        if self.physics_enabled:
+            if stepped:
+                self.drive_stale = True
+            else:
+                self.drive.step(dt)
+                self.apply_drive(self.drive.rows()[self.drive_index])
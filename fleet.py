@@ -0,0 +1,265 @@
+import argparse
+import os
+import random
+import selectors
+import threading
+import time
+
+import serial
+
+from dispatch import default_dispatcher
+from engine import SimulatorModel
+from physics import Drivetrain
+from protocol import FrameDecoder, ReplyWriter
+from scheduler import MAX_RATE, TickScheduler
+
+READ_SIZE = 4096
+# Reply bytes a link holds for a harness that is not reading; whole replies
+# beyond this are dropped rather than stalling the other devices
+PENDING_LIMIT = 64 * 1024
+
+class SerialLink:
+    # A real (or virtual) serial port opened through pyserial
+    def __init__(self, port, baudrate=115200):
+        self.name = port
+        self.ser = serial.Serial(port, baudrate, timeout=0)
+
+    def fileno(self):
+        return self.ser.fileno()
+
+    def read(self):
+        return self.ser.read(self.ser.in_waiting or 1)
+
+    def write(self, data):
+        self.ser.write(data)
+
+    # pyserial writes block, so nothing is ever left pending
+    pending = b''
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.ser.close()
+
+class PtyLink:
+    # A pseudo-terminal pair. The simulator uses the master side; the firmware
+    # or test harness opens slave_name as if it were a serial port.
+    def __init__(self):
+        # tty is POSIX only, so it is not imported at module level
+        import tty
+        self.master_fd, self.slave_fd = os.openpty()
+        # Raw mode so the line discipline does not echo or translate bytes
+        tty.setraw(self.slave_fd)
+        self.slave_name = os.ttyname(self.slave_fd)
+        self.name = self.slave_name
+        os.set_blocking(self.master_fd, False)
+        # What the pty could not take yet, sent by flush()
+        self.pending = bytearray()
+        self.dropped = 0
+
+    def fileno(self):
+        return self.master_fd
+
+    def read(self):
+        try:
+            return os.read(self.master_fd, READ_SIZE)
+        except BlockingIOError:
+            return b''
+
+    def write(self, data):
+        # Never blocks: whatever the pty has no room for waits in `pending`
+        # until the fleet's selector reports room and calls flush()
+        if self.pending:
+            if len(self.pending) + len(data) > PENDING_LIMIT:
+                self.dropped += 1
+                return
+            self.pending += data
+            self.flush()
+            return
+        try:
+            written = os.write(self.master_fd, data)
+        except BlockingIOError:
+            written = 0
+        if written < len(data):
+            self.pending += memoryview(data)[written:]
+
+    def flush(self):
+        if not self.pending:
+            return
+        try:
+            written = os.write(self.master_fd, self.pending)
+        except BlockingIOError:
+            return
+        del self.pending[:written]
+
+    def close(self):
+        os.close(self.master_fd)
+        # Kept open until now so the master never sees EIO when the
+        # harness closes and reopens the slave
+        os.close(self.slave_fd)
+
+class SimulatedDevice:
+    def __init__(self, link, model=None, dispatcher=default_dispatcher, metrics=None):
+        self.link = link
+        self.model = model if model is not None else SimulatorModel()
+        self.decoder = FrameDecoder()
+        self.dispatcher = dispatcher
+        self.metrics = metrics
+        self.writer = ReplyWriter(link.write)
+        self.replies = 0
+        self.errors = 0
+
+    def service(self):
+        # Handle everything currently readable on the link. An error is
+        # logged and counted, so one device cannot take down a whole fleet.
+        try:
+            self.link.flush()
+            self.handle(self.link.read())
+        except Exception as e:
+            self.errors += 1
+            print("{}: {}: {}".format(self.link.name, type(e).__name__, e))
+
+    def flush(self):
+        try:
+            self.link.flush()
+        except OSError as e:
+            self.errors += 1
+            print("{}: {}: {}".format(self.link.name, type(e).__name__, e))
+
+    def handle(self, data):
+        if not data:
+            return
+        self.model.sync_drive()
+        if self.metrics is not None:
+            self.metrics.handle(data, self.decoder, self.model, self.dispatcher, self.writer)
+            return
+        for frame in self.decoder.frames(data):
+            reply = self.dispatcher.dispatch(self.model, frame)
+            if reply:
+                self.writer.add(reply)
+                self.replies += 1
+        self.writer.send()
+
+class Fleet:
+    # Many simulated devices driven from a single thread: one selector waits
+    # on every link and the model ticks are interleaved with the I/O
+    def __init__(self, tick_rate=100.0):
+        self.devices = []
+        self.drive = None
+        self.scheduler = TickScheduler(self.tick, tick_rate)
+        self.stop_event = threading.Event()
+
+    def add(self, device):
+        self.devices.append(device)
+        return device
+
+    def share_drive(self):
+        # One Drivetrain for the whole fleet, so the physics of every device
+        # is a single vectorised step per tick
+        drive = Drivetrain(len(self.devices), self.devices[0].model.drive.params)
+        for index, device in enumerate(self.devices):
+            device.model.use_drive(drive, index)
+        self.drive = drive
+
+    def tick(self, dt):
+        devices = self.devices
+        if not devices:
+            return
+        if self.drive is None or len(self.drive) != len(devices):
+            self.share_drive()
+        self.drive.step(dt)
+        # Snapshots are only rebuilt for devices that are sweeping; the rest
+        # apply their results when they are next polled
+        for device in devices:
+            model = device.model
+            if model.sweeping:
+                model.tick(dt, stepped=True)
+            elif model.physics_enabled:
+                model.drive_stale = True
+
+    def run(self):
+        try:
+            selector = selectors.DefaultSelector()
+            for device in self.devices:
+                selector.register(device.link.fileno(), selectors.EVENT_READ, device)
+        except (OSError, ValueError, AttributeError):
+            # Links without a selectable file descriptor (e.g. COM ports)
+            self.run_polling()
+            return
+
+        scheduler = self.scheduler
+        scheduler.start()
+        timeout = scheduler.dt
+        while not self.stop_event.is_set():
+            for key, mask in selector.select(min(timeout, 0.1)):
+                device = key.data
+                if mask & selectors.EVENT_WRITE:
+                    device.flush()
+                if mask & selectors.EVENT_READ:
+                    device.service()
+                # Wait for room in the link only while replies are pending
+                events = selectors.EVENT_READ | (selectors.EVENT_WRITE if device.link.pending else 0)
+                if events != key.events:
+                    selector.modify(key.fileobj, events, device)
+            timeout = scheduler.poll()
+        selector.close()
+
+    def run_polling(self):
+        scheduler = self.scheduler
+        scheduler.start()
+        while not self.stop_event.is_set():
+            for device in self.devices:
+                device.service()
+            scheduler.poll()
+            time.sleep(0.001)
+
+    def stop(self):
+        self.stop_event.set()
+
+    def close(self):
+        for device in self.devices:
+            device.link.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run many simulated VESCs in one process")
+    parser.add_argument("-p", "--ports", help="serial ports to simulate a device on",
+                        nargs="*", default=[])
+    parser.add_argument("--pty", help="number of pty-backed devices to create",
+                        type=int, default=0)
+    parser.add_argument("--tick", help="sweep RPM and voltage on every device",
+                        action="store_true", default=False)
+    parser.add_argument("--tick-rate", help="model ticks per second (up to 1000)",
+                        type=float, default=100.0)
+    parser.add_argument("--seed", help="seed for the per-device sweep phase",
+                        type=int, default=0)
+    args = parser.parse_args(argv)
+    if not 0 < args.tick_rate <= MAX_RATE:
+        parser.error("--tick-rate must be above 0 and at most {:.0f}".format(MAX_RATE))
+
+    fleet = Fleet(args.tick_rate)
+    for port in args.ports:
+        fleet.add(SimulatedDevice(SerialLink(port)))
+    for _ in range(args.pty):
+        fleet.add(SimulatedDevice(PtyLink()))
+
+    # Give each device its own starting point so the fleet is not in lockstep
+    rng = random.Random(args.seed)
+    for device in fleet.devices:
+        model = device.model
+        model.rpm_tick_enabled = args.tick
+        model.voltage_tick_enabled = args.tick
+        model.rpm_tick_up = rng.random() < 0.5
+        model.set_rpm(rng.randint(model.min_rpm, model.max_rpm))
+        print(device.link.name)
+
+    try:
+        fleet.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fleet.close()
+    print("Tick scheduler: ", fleet.scheduler.stats)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import collections
+import os
+import random
+import struct
+import time
+
+import crc
+from capture import INBOUND, RAW, CaptureWriter
+from commands import COMM_CUSTOM_APP_DATA, COMM_GET_VALUES
+from protocol import FRAME_END, encode_frame
+
+# Payloads longer than the single length byte allows use the long frame
+# format: 0x03, 16-bit length, payload, CRC, 0x03
+LONG_FRAME_START = 0x03
+LONG_FRAME_HEADER = struct.Struct('>BH')
+MAX_LONG_PAYLOAD = 512
+
+# Each mutation is a plan and an apply step. plan(rng) draws everything
+# random up front, independent of the reply, so the draws depend only on
+# the seed; apply(frame, values) then mutates the current valid reply frame
+# (a bytearray) and returns the bytes to send. Positions are drawn as
+# fractions and scaled to the frame at apply time.
+
+def plan_bit_flip(rng):
+    return [rng.random() for _ in range(rng.randint(1, 8))]
+
+def bit_flip(frame, positions):
+    bits = len(frame) * 8
+    for fraction in positions:
+        position = int(fraction * bits)
+        frame[position >> 3] ^= 1 << (position & 7)
+    return frame
+
+def plan_lie_length(rng):
+    return rng.randint(1, 255)
+
+def lie_length(frame, delta):
+    frame[1] = (frame[1] + delta) & 0xFF
+    return frame
+
+def plan_corrupt_crc(rng):
+    return rng.randint(1, 255), rng.randint(0, 255)
+
+def corrupt_crc(frame, masks):
+    frame[-3] ^= masks[0]
+    frame[-2] ^= masks[1]
+    return frame
+
+def plan_truncate(rng):
+    return rng.random()
+
+def truncate(frame, fraction):
+    return frame[:1 + int(fraction * (len(frame) - 1))]
+
+def plan_drop_end(rng):
+    return rng.random() < 0.5, rng.choice([b for b in range(256) if b != FRAME_END])
+
+def drop_end(frame, values):
+    drop, end = values
+    if drop:
+        return frame[:-1]
+    frame[-1] = end
+    return frame
+
+def plan_oversize(rng):
+    return rng.randint(256, MAX_LONG_PAYLOAD), rng.randbytes(MAX_LONG_PAYLOAD), rng.random() < 0.5
+
+def oversize(frame, values):
+    # A payload past the 255 bytes a single length byte can describe,
+    # either as a proper long frame or with the length byte wrapped
+    size, garbage, long_frame = values
+    payload = frame[2:-3]
+    payload += garbage[:size - len(payload)]
+    payload_crc = crc.crc16(payload)
+    if long_frame:
+        return LONG_FRAME_HEADER.pack(LONG_FRAME_START, len(payload)) + payload + struct.pack('>HB', payload_crc, FRAME_END)
+    return bytes((frame[0], len(payload) & 0xFF)) + payload + struct.pack('>HB', payload_crc, FRAME_END)
+
+def plan_append_garbage(rng):
+    return rng.random(), rng.randbytes(255)
+
+def append_garbage(frame, values):
+    # The original --fuzz behaviour: valid framing around trailing junk
+    fraction, garbage = values
+    payload = frame[2:-3]
+    return encode_frame(payload + garbage[:int(fraction * (256 - len(payload)))])
+
+STRATEGIES = {
+    "bit_flip": (plan_bit_flip, bit_flip),
+    "lie_length": (plan_lie_length, lie_length),
+    "corrupt_crc": (plan_corrupt_crc, corrupt_crc),
+    "truncate": (plan_truncate, truncate),
+    "drop_end": (plan_drop_end, drop_end),
+    "oversize": (plan_oversize, oversize),
+    "append_garbage": (plan_append_garbage, append_garbage),
+}
+
+FUZZED_COMMANDS = (COMM_GET_VALUES, COMM_CUSTOM_APP_DATA)
+
+class Fuzzer:
+    # Seeded, so a run can be repeated exactly from its seed and request
+    # sequence: the n-th fuzzed request always gets the n-th recipe, however
+    # the replies change in between. Recipes are drawn a batch at a time,
+    # so the serial loop only applies a ready one to the current reply.
+    def __init__(self, seed=None, strategies=None, rate=1.0, batch_size=256):
+        self.seed = seed if seed is not None else random.randrange(1 << 32)
+        self.rng = random.Random(self.seed)
+        self.strategies = [STRATEGIES[name] for name in (strategies or sorted(STRATEGIES))]
+        self.rate = rate
+        self.batch_size = batch_size
+        self.recipes = []
+        self.position = 0
+        self.requests = 0
+        self.mutated = 0
+        self.batches_generated = 0
+
+    def generate(self):
+        rng = self.rng
+        strategies = self.strategies
+        batch = []
+        for _ in range(self.batch_size):
+            if rng.random() < self.rate:
+                plan, apply = rng.choice(strategies)
+                batch.append((apply, plan(rng)))
+            else:
+                batch.append(None)
+        self.batches_generated += 1
+        return batch
+
+    def mutate(self, command, reply):
+        # Returns the frame to send in place of `reply`
+        if self.position >= len(self.recipes):
+            self.recipes = self.generate()
+            self.position = 0
+        recipe = self.recipes[self.position]
+        self.position += 1
+        self.requests += 1
+        if recipe is None:
+            return reply
+        self.mutated += 1
+        apply, values = recipe
+        return bytes(apply(bytearray(reply), values))
+
+class FuzzingDispatcher:
+    # Wraps a dispatcher and mutates the replies to the fuzzed commands.
+    # The last `history` requests and replies are kept; if the LCM stops
+    # polling for `stall_timeout` seconds they are saved as a capture so
+    # the sequence that hung it can be replayed with `capture.py raw`.
+    def __init__(self, dispatcher, fuzzer, crash_dir="crashes", history=256, stall_timeout=2.0):
+        self.dispatcher = dispatcher
+        self.fuzzer = fuzzer
+        self.crash_dir = crash_dir
+        self.history = collections.deque(maxlen=history)
+        self.stall_timeout = stall_timeout
+        self.last_request = None
+        self.crashes = []
+
+    def dispatch(self, model, frame):
+        now = time.monotonic()
+        self.check(now)
+        self.last_request = now
+        self.history.append((now, INBOUND, bytes(frame)))
+
+        reply = self.dispatcher.dispatch(model, frame)
+        if reply and frame[0] in FUZZED_COMMANDS:
+            reply = self.fuzzer.mutate(frame[0], reply)
+        if reply:
+            self.history.append((time.monotonic(), RAW, bytes(reply)))
+        return reply
+
+    def check(self, now=None):
+        # Call periodically, or at exit, to catch an LCM that never recovers
+        now = time.monotonic() if now is None else now
+        if self.last_request is not None and self.history and now - self.last_request > self.stall_timeout:
+            self.save_crash(now - self.last_request)
+
+    def save_crash(self, stalled_for):
+        os.makedirs(self.crash_dir, exist_ok=True)
+        path = os.path.join(self.crash_dir, "stall-seed{}-{}.cap".format(
+            self.fuzzer.seed, time.strftime("%Y%m%d-%H%M%S")))
+        writer = CaptureWriter(path)
+        for timestamp, direction, data in self.history:
+            writer.record(direction, data, timestamp)
+        writer.close()
+        self.history.clear()
+        self.crashes.append(path)
+        print("LCM stopped polling for {:.1f} s, saved the last {} frames to {}".format(
+            stalled_for, writer.records, path))
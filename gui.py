@@ -0,0 +1,274 @@
+import tkinter as tk
+
+# How often the view is refreshed from the model, frames per second
+REFRESH_RATE = 30.0
+
+def set_if_changed(var, value):
+    if var.get() != value:
+        var.set(value)
+
+class Control:
+    # Traces on a control's variables push edits to the model. While the
+    # view is being refreshed from the model those writes are only echoes of
+    # the model's own state, so the traces ignore them.
+    refreshing = False
+
+    def refresh(self):
+        self.refreshing = True
+        try:
+            self.pull()
+        finally:
+            self.refreshing = False
+
+    def pull(self):
+        pass
+
+class BatteryVoltageControl(Control):
+    def __init__(self, master, model):
+        self.master = master
+        self.model = model
+        self.min_voltage = tk.DoubleVar(value=model.min_voltage)
+        self.max_voltage = tk.DoubleVar(value=model.max_voltage)
+        self.voltage = tk.DoubleVar(value=model.voltage)
+        self.enable_tick = tk.BooleanVar(value=model.voltage_tick_enabled)
+
+        self.label_frame = tk.LabelFrame(master, text="Battery Voltage Control")
+        self.label_frame.pack(padx=10, pady=10, fill=tk.X, expand=True)
+
+        self.min_label = tk.Label(self.label_frame, text="Minimum Voltage:")
+        self.min_label.grid(row=0, column=0, padx=5, pady=5)
+        self.min_spinbox = tk.Spinbox(self.label_frame, from_=0.0, to=100.0, increment=0.1, textvariable=self.min_voltage)
+        self.min_spinbox.grid(row=0, column=1, padx=5, pady=5)
+        self.min_tooltip = tk.Label(self.label_frame, text="Minimum voltage threshold")
+        self.min_tooltip.grid(row=0, column=2, padx=5, pady=5)
+
+        self.max_label = tk.Label(self.label_frame, text="Maximum Voltage:")
+        self.max_label.grid(row=1, column=0, padx=5, pady=5)
+        self.max_spinbox = tk.Spinbox(self.label_frame, from_=0.0, to=200.0, increment=0.1, textvariable=self.max_voltage)
+        self.max_spinbox.grid(row=1, column=1, padx=5, pady=5)
+        self.max_tooltip = tk.Label(self.label_frame, text="Maximum voltage threshold")
+        self.max_tooltip.grid(row=1, column=2, padx=5, pady=5)
+
+        self.scale = tk.Scale(self.label_frame, from_=self.min_voltage.get(), to=self.max_voltage.get(), resolution=0.1, orient=tk.HORIZONTAL, variable=self.voltage)
+        self.scale.grid(row=2, column=0, columnspan=3, padx=5, pady=5, sticky="ew")
+
+        self.enable_tick_checkbox = tk.Checkbutton(self.label_frame, text="Enable", variable=self.enable_tick)
+        self.enable_tick_checkbox.grid(row=3, column=0, columnspan=3, padx=5, pady=5)
+
+        self.min_voltage.trace_add("write", self.update_scale)
+        self.max_voltage.trace_add("write", self.update_scale)
+        self.voltage.trace_add("write", self.update_voltage)
+        self.enable_tick.trace_add("write", self.update_enable_tick)
+
+    def update_voltage(self, *args):
+        if not self.refreshing:
+            self.model.set_voltage(self.voltage.get())
+
+    def update_scale(self, *args):
+        self.model.min_voltage = self.min_voltage.get()
+        self.model.max_voltage = self.max_voltage.get()
+        self.scale.config(from_=self.model.min_voltage, to=self.model.max_voltage)
+
+    def update_enable_tick(self, *args):
+        self.model.voltage_tick_enabled = self.enable_tick.get()
+
+    def pull(self):
+        set_if_changed(self.voltage, self.model.voltage)
+
+class DutyCycleControl(Control):
+    def __init__(self, master, model):
+        self.master = master
+        self.model = model
+        self.duty_cycle = tk.DoubleVar(value=model.duty_cycle)
+        self.link_to_rpm = tk.BooleanVar(value=model.duty_cycle_linked)
+
+        self.label_frame = tk.LabelFrame(master, text="Duty Cycle Control")
+        self.label_frame.pack(padx=10, pady=10, fill=tk.X, expand=True)
+
+        self.scale = tk.Scale(self.label_frame, from_=-1.0, to=1.0, resolution=0.01, orient=tk.HORIZONTAL, variable=self.duty_cycle)
+        self.scale.pack(padx=5, pady=5, fill=tk.X, expand=True)
+
+        self.link_checkbox = tk.Checkbutton(self.label_frame, text="Link to motor model", variable=self.link_to_rpm)
+        self.link_checkbox.pack(padx=5, pady=5)
+
+        self.duty_cycle.trace_add("write", self.update_duty_cycle)
+        self.link_to_rpm.trace_add("write", self.update_link_to_rpm)
+
+    def update_duty_cycle(self, *args):
+        if not self.refreshing:
+            self.model.set_duty_cycle(self.duty_cycle.get())
+
+    def update_link_to_rpm(self, *args):
+        self.model.duty_cycle_linked = self.link_to_rpm.get()
+
+    def pull(self):
+        set_if_changed(self.duty_cycle, self.model.duty_cycle)
+
+class InputCurrentControl(Control):
+    def __init__(self, master, model):
+        self.master = master
+        self.model = model
+        self.input_current = tk.DoubleVar(value=model.input_current)
+        self.link_to_rpm = tk.BooleanVar(value=model.input_current_linked)
+
+        self.label_frame = tk.LabelFrame(master, text="Input Current Control")
+        self.label_frame.pack(padx=10, pady=10, fill=tk.X, expand=True)
+
+        self.scale = tk.Scale(self.label_frame, from_=-50.0, to=50.0, resolution=0.1, orient=tk.HORIZONTAL, variable=self.input_current)
+        self.scale.pack(padx=5, pady=5, fill=tk.X, expand=True)
+
+        self.link_checkbox = tk.Checkbutton(self.label_frame, text="Link to motor model", variable=self.link_to_rpm)
+        self.link_checkbox.pack(padx=5, pady=5)
+
+        self.input_current.trace_add("write", self.update_input_current)
+        self.link_to_rpm.trace_add("write", self.update_link_to_rpm)
+
+    def update_input_current(self, *args):
+        if not self.refreshing:
+            self.model.set_input_current(self.input_current.get())
+
+    def update_link_to_rpm(self, *args):
+        self.model.input_current_linked = self.link_to_rpm.get()
+
+    def pull(self):
+        set_if_changed(self.input_current, self.model.input_current)
+
+class RPMControl(Control):
+    def __init__(self, master, model):
+        self.master = master
+        self.model = model
+        self.enable_tick = tk.BooleanVar(value=model.rpm_tick_enabled)
+
+        self.min_rpm = tk.IntVar(value=model.min_rpm)
+        self.max_rpm = tk.IntVar(value=model.max_rpm)
+        self.rpm = tk.IntVar(value=model.rpm)
+        self.tire_circumference = tk.DoubleVar(value=model.tire_circumference)
+        self.speed_mph = tk.StringVar(value=f"{model.speed_mph:.1f} mph")
+
+        self.label_frame = tk.LabelFrame(master, text="RPM Control")
+        self.label_frame.pack(padx=10, pady=10, fill=tk.X, expand=True)
+
+        # Minimum RPM Spinbox
+        self.min_label = tk.Label(self.label_frame, text="Min RPM")
+        self.min_label.grid(row=0, column=0, padx=5, pady=5)
+        self.min_spinbox = tk.Spinbox(self.label_frame, from_=-10000, to=10000, textvariable=self.min_rpm)
+        self.min_spinbox.grid(row=0, column=1, padx=5, pady=5)
+
+        # Maximum RPM Spinbox
+        self.max_label =tk.Label(self.label_frame, text="Max RPM")
+        self.max_label.grid(row=1, column=0, padx=5, pady=5)
+        self.max_spinbox = tk.Spinbox(self.label_frame, from_=-10000, to=10000, textvariable=self.max_rpm)
+        self.max_spinbox.grid(row=1, column=1, padx=5, pady=5)
+
+        # RPM Scale
+        self.rpm_scale = tk.Scale(self.label_frame, from_=self.min_rpm.get(), to=self.max_rpm.get(), orient=tk.HORIZONTAL, variable=self.rpm)
+        self.rpm_scale.grid(row=2, column=0, columnspan=2, padx=5, pady=5, sticky="ew")
+
+        # Speed MPH Label
+        self.mph_label = tk.Label(self.label_frame, textvariable=self.speed_mph)
+        self.mph_label.grid(row=2, column=3, padx=5, pady=5)
+
+        # Tire Circumference Spinbox
+        self.tire_circumference_label = tk.Label(self.label_frame, text="Tire Circumference (inches)")
+        self.tire_circumference_label.grid(row=3, column=0, padx=5, pady=5)
+        self.tire_circumference_spinbox = tk.Spinbox(self.label_frame, from_=0.0, to=100.0, increment=0.1, textvariable=self.tire_circumference)
+        self.tire_circumference_spinbox.grid(row=3, column=1, padx=5, pady=5)
+
+        self.enable_tick_checkbox = tk.Checkbutton(self.label_frame, text="Enable Tick", variable=self.enable_tick)
+        self.enable_tick_checkbox.grid(row=4, column=0, columnspan=2, padx=5, pady=5)
+
+        self.rpm.trace_add("write", self.update_rpm)
+        self.tire_circumference.trace_add("write", self.update_tire_circumference)
+        # Update RPM scale range when min or max RPM changes
+        self.min_rpm.trace_add("write", self.update_rpm_scale)
+        self.max_rpm.trace_add("write", self.update_rpm_scale)
+        self.enable_tick.trace_add("write", self.update_enable_tick)
+
+    def update_rpm(self, *args):
+        # The model keeps fractional RPM, which a refresh shows rounded
+        if not self.refreshing:
+            self.model.set_rpm(self.rpm.get())
+
+    def update_tire_circumference(self, *args):
+        self.model.tire_circumference = self.tire_circumference.get()
+
+    def update_rpm_scale(self, *args):
+        self.model.min_rpm = self.min_rpm.get()
+        self.model.max_rpm = self.max_rpm.get()
+        self.rpm_scale.config(from_=self.model.min_rpm, to=self.model.max_rpm)
+
+    def update_enable_tick(self, *args):
+        self.model.rpm_tick_enabled = self.enable_tick.get()
+
+    def pull(self):
+        set_if_changed(self.rpm, round(self.model.rpm))
+        set_if_changed(self.speed_mph, f"{self.model.speed_mph:.1f} mph")
+
+class FloatControl(Control):
+    def __init__(self, master, model):
+        self.master = master
+        self.model = model
+        self.enabled = tk.BooleanVar(value=model.float_enabled)
+        self.headlight_brightness = tk.IntVar(value=model.lcm_poll_response.headlightBrightness)
+        self.headlight_idle_brightness = tk.IntVar(value=model.lcm_poll_response.headlightIdleBrightness)
+        self.statusbar_brightness = tk.IntVar(value=model.lcm_poll_response.statusbarBrightness)
+
+        self.label_frame = tk.LabelFrame(self.master, text="Float Control")
+        self.label_frame.pack(padx=10, pady=10, fill=tk.X, expand=True)
+
+        # Create checkbox to enable/disable settings
+        tk.Checkbutton(self.label_frame, text="Enable", variable=self.enabled).grid(row=0, column=0, columnspan=2, padx=5, pady=5)
+
+        # Create sliders
+        tk.Label(self.label_frame, text="Headlight Brightness").grid(row=1, column=0, padx=5, pady=5)
+        tk.Scale(self.label_frame, from_=0, to=100, orient=tk.HORIZONTAL, variable=self.headlight_brightness, command=self.model.set_headlight_brightness).grid(row=1, column=1, padx=5, pady=5, sticky=tk.EW)
+        tk.Label(self.label_frame, text="Headlight Idle Brightness").grid(row=2, column=0, padx=5, pady=5)
+        tk.Scale(self.label_frame, from_=0, to=100, orient=tk.HORIZONTAL, variable=self.headlight_idle_brightness, command=self.model.set_headlight_idle_brightness).grid(row=2, column=1, padx=5, pady=5, sticky=tk.EW)
+        tk.Label(self.label_frame, text="Statusbar Brightness").grid(row=3, column=0, padx=5, pady=5)
+        tk.Scale(self.label_frame, from_=0, to=100, orient=tk.HORIZONTAL, variable=self.statusbar_brightness, command=self.model.set_statusbar_brightness).grid(row=3, column=1, padx=5, pady=5, sticky=tk.EW)
+        self.label_frame.grid_columnconfigure(1, weight=1)
+
+        self.enabled.trace_add("write", self.update_enabled)
+
+    def update_enabled(self, *args):
+        self.model.float_enabled = self.enabled.get()
+
+class SimulatorGUI:
+    def __init__(self, root, model, fps=REFRESH_RATE):
+        self.root = root
+        self.model = model
+        self.interval_ms = max(1, round(1000 / fps))
+        self.shown_snapshot = None
+        self.shown_speed = None
+        self.battery_control = BatteryVoltageControl(root, model)
+        self.duty_cycle_control = DutyCycleControl(root, model)
+        self.input_current_control = InputCurrentControl(root, model)
+        self.rpm_control = RPMControl(root, model)
+        self.float_control = FloatControl(root, model)
+        self.controls = [
+            self.battery_control,
+            self.duty_cycle_control,
+            self.input_current_control,
+            self.rpm_control,
+            self.float_control,
+        ]
+        self.refresh()
+
+    def refresh(self):
+        # The model is changed by the tick thread; pull it into the widgets
+        # at a capped rate, however fast it ticks, and only when a new
+        # snapshot (or tire size) means something on screen changed
+        snapshot = self.model.snapshot
+        speed = self.model.speed_mph
+        if snapshot is not self.shown_snapshot or speed != self.shown_speed:
+            self.shown_snapshot = snapshot
+            self.shown_speed = speed
+            for control in self.controls:
+                control.refresh()
+        self.root.after(self.interval_ms, self.refresh)
+
+def run_gui(model, fps=REFRESH_RATE):
+    root = tk.Tk()
+    root.title("VESC Simulator")
+    SimulatorGUI(root, model, fps)
+    root.mainloop()
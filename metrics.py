@@ -0,0 +1,185 @@
+import bisect
+import http.server
+import os
+import socketserver
+import threading
+import time
+
+from commands import COMM_CUSTOM_APP_DATA
+
+# Histogram bucket upper bounds: 1 us to ~1 s in steps of sqrt(2)
+BUCKETS = [1e-6 * 2 ** (i / 2) for i in range(41)]
+STAGES = ("decode", "dispatch", "encode", "write", "total")
+
+def command_label(frame):
+    # "04" for plain commands, "24-65-18" for custom app commands
+    if frame[0] == COMM_CUSTOM_APP_DATA and len(frame) >= 3:
+        return "{:02x}-{:02x}-{:02x}".format(frame[0], frame[1], frame[2])
+    return "{:02x}".format(frame[0])
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        # Interpolated within the bucket, so accurate to about +-20%
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(lower + (upper - lower) * (rank - seen) / count, self.max)
+            seen += count
+        return self.max
+
+class Metrics:
+    # Per command timings of each stage of a request, from the read that
+    # completed its frame to the reply write returning:
+    #   decode   - finding the frame in the received bytes
+    #   dispatch - looking up the handler
+    #   encode   - running the handler, which builds the reply frame
+    #   write    - handing the replies of one read to the port
+    #   total    - all of the above
+    def __init__(self):
+        self.histograms = {}
+        self.frames = 0
+        self.replies = 0
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.started = time.monotonic()
+        self.last_log = (self.started, 0, 0, 0)
+
+    def observe(self, stage, label, seconds):
+        histogram = self.histograms.get((stage, label))
+        if histogram is None:
+            histogram = self.histograms[(stage, label)] = Histogram()
+        histogram.observe(seconds)
+
+    def observe_dispatch(self, frame, lookup, handler):
+        # Called by Dispatcher.dispatch
+        label = command_label(frame)
+        self.observe("dispatch", label, lookup)
+        self.observe("encode", label, handler)
+
+    def handle(self, data, decoder, model, dispatcher, writer):
+        # Instrumented equivalent of decoding `data` and sending the replies
+        # through a ReplyWriter
+        received = time.perf_counter()
+        self.bytes_received += len(data)
+        labels = []
+        start = received
+        for frame in decoder.frames(data):
+            label = command_label(frame)
+            labels.append(label)
+            self.observe("decode", label, time.perf_counter() - start)
+            reply = dispatcher.dispatch(model, frame)
+            if reply:
+                writer.add(reply)
+                self.replies += 1
+                self.bytes_sent += len(reply)
+            start = time.perf_counter()
+        if not labels:
+            return
+        # The frames of one read share the write
+        start = time.perf_counter()
+        writer.send()
+        done = time.perf_counter()
+        for label in labels:
+            self.observe("write", label, done - start)
+            self.observe("total", label, done - received)
+        self.frames += len(labels)
+
+    def log_line(self):
+        # Rates since the previous log line, then p50/p99/max of the totals
+        now = time.monotonic()
+        last_time, last_frames, last_received, last_sent = self.last_log
+        elapsed = max(now - last_time, 1e-9)
+        self.last_log = (now, self.frames, self.bytes_received, self.bytes_sent)
+        line = "Metrics: {:.0f} frames/s, {:.0f} B/s in, {:.0f} B/s out".format(
+            (self.frames - last_frames) / elapsed,
+            (self.bytes_received - last_received) / elapsed,
+            (self.bytes_sent - last_sent) / elapsed)
+        for (stage, label), histogram in sorted(self.histograms.items()):
+            if stage == "total":
+                line += "; {} p50={:.0f}us p99={:.0f}us max={:.0f}us".format(
+                    label, histogram.quantile(0.5) * 1e6, histogram.quantile(0.99) * 1e6, histogram.max * 1e6)
+        return line
+
+    def prometheus(self):
+        lines = [
+            "# TYPE vesc_sim_frames_total counter",
+            "vesc_sim_frames_total {}".format(self.frames),
+            "# TYPE vesc_sim_replies_total counter",
+            "vesc_sim_replies_total {}".format(self.replies),
+            "# TYPE vesc_sim_received_bytes_total counter",
+            "vesc_sim_received_bytes_total {}".format(self.bytes_received),
+            "# TYPE vesc_sim_sent_bytes_total counter",
+            "vesc_sim_sent_bytes_total {}".format(self.bytes_sent),
+            "# TYPE vesc_sim_uptime_seconds gauge",
+            "vesc_sim_uptime_seconds {:.3f}".format(time.monotonic() - self.started),
+            "# TYPE vesc_sim_stage_seconds histogram",
+        ]
+        for (stage, label), histogram in sorted(self.histograms.items()):
+            labels = 'stage="{}",command="{}"'.format(stage, label)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append('vesc_sim_stage_seconds_bucket{{{},le="{:.3g}"}} {}'.format(labels, bound, cumulative))
+            lines.append('vesc_sim_stage_seconds_bucket{{{},le="+Inf"}} {}'.format(labels, histogram.count))
+            lines.append('vesc_sim_stage_seconds_sum{{{}}} {:.9f}'.format(labels, histogram.sum))
+            lines.append('vesc_sim_stage_seconds_count{{{}}} {}'.format(labels, histogram.count))
+        return "\n".join(lines) + "\n"
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = self.server.metrics.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        # BaseHTTPRequestHandler expects an address tuple
+        request, _ = super().get_request()
+        return request, ("unix", 0)
+
+def serve_metrics(metrics, address=None, path=None):
+    # Serve GET /metrics over TCP (HOST:PORT) or a Unix socket from a daemon
+    # thread; returns the server so it can be shut down
+    if path is not None:
+        if os.path.exists(path):
+            os.unlink(path)
+        server = UnixHTTPServer(path, MetricsHandler)
+    else:
+        host, _, port = address.rpartition(":")
+        server = http.server.ThreadingHTTPServer((host or "127.0.0.1", int(port)), MetricsHandler)
+    server.metrics = metrics
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def logging_loop(metrics, interval, stop_event):
+    while not stop_event.wait(interval):
+        print(metrics.log_line())
@@ -0,0 +1,225 @@
+import itertools
+import operator
+import struct
+from dataclasses import dataclass, fields
+from typing import ClassVar
+
+import commands
+from protocol import FRAME_OVERHEAD, frame_into, parse_frame
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+# Reply buffers per packet. A snapshot's frame stays valid until this many
+# newer snapshots have been encoded; callers copy it straight out (into a
+# ReplyWriter) long before that.
+REPLY_BUFFERS = 4
+
+class Packet:
+    # Base for reply packets. Every field change bumps `version`, so the
+    # model can tell when to take a new snapshot of the fields. Snapshots
+    # are framed into a small ring of reusable reply buffers, so steady
+    # state polling allocates nothing; cache_stats counts polls served from
+    # an already framed snapshot (hits) against encodes (misses).
+    PAYLOAD: ClassVar[struct.Struct]
+
+    def __post_init__(self):
+        # Reusable reply buffers: start byte, length, payload, CRC, end byte
+        self.reply_buffers = [bytearray(self.PAYLOAD.size + FRAME_OVERHEAD) for _ in range(REPLY_BUFFERS)]
+        self.reply_slots = itertools.count()
+        self.cache_stats = CacheStats()
+        self.version = 0
+
+    def __setattr__(self, name, value):
+        if name in self.__dataclass_fields__:
+            changed = getattr(self, name, None) != value
+            object.__setattr__(self, name, value)
+            # Bump after the write, so a snapshot taken concurrently is
+            # followed by another one with the new value
+            if changed:
+                object.__setattr__(self, 'version', getattr(self, 'version', 0) + 1)
+        else:
+            object.__setattr__(self, name, value)
+
+    def assign(self, names, values):
+        # Set several fields with at most one version bump
+        changed = False
+        for name, value in zip(names, values):
+            if getattr(self, name) != value:
+                object.__setattr__(self, name, value)
+                changed = True
+        if changed:
+            object.__setattr__(self, 'version', self.version + 1)
+
+    def field_values(self):
+        # Immutable copy of the fields in declaration order, e.g. for a snapshot
+        cls = type(self)
+        getter = cls.__dict__.get('_field_getter')
+        if getter is None:
+            getter = operator.attrgetter(*(field.name for field in fields(cls)))
+            cls._field_getter = getter
+        return getter(self)
+
+    @classmethod
+    def pack_values(cls, buffer, offset, values):
+        # Pack a field_values() tuple; subclasses apply the wire scaling
+        raise NotImplementedError
+
+    def frame_values(self, values) -> bytearray:
+        # Encode a field_values() tuple straight into the next reply buffer
+        # and frame it in place. next() on the counter is atomic, so racing
+        # pollers never share a buffer.
+        buffer = self.reply_buffers[next(self.reply_slots) % REPLY_BUFFERS]
+        self.pack_values(buffer, 2, values)
+        frame_into(buffer, self.PAYLOAD.size)
+        self.cache_stats.misses += 1
+        return buffer
+
+    @classmethod
+    def unpack_values(cls, buffer, offset=0):
+        # Inverse of pack_values, reading straight out of `buffer`
+        raise NotImplementedError
+
+    @classmethod
+    def from_payload(cls, buffer, offset=0):
+        return cls(*cls.unpack_values(buffer, offset))
+
+    def pack_into(self, buffer, offset=0):
+        self.pack_values(buffer, offset, self.field_values())
+
+    def update_from(self, buffer, offset=0):
+        # Inverse of pack_into, e.g. to load a captured reply
+        for field, value in zip(fields(self), self.unpack_values(buffer, offset)):
+            setattr(self, field.name, value)
+
+@dataclass
+class COMM_GET_VALUES(Packet):
+    # Big-endian wire layout, floats are sent as scaled fixed-point integers
+    PAYLOAD: ClassVar[struct.Struct] = struct.Struct('>BhhiiiihihiiiiiiB')
+
+    id: int 
+    temp_fet: float 
+    temp_motor: float
+    avg_motor_current: float
+    avg_input_current: float
+    avg_id: float 
+    avg_iq: float 
+    duty_cycle_now: float 
+    rpm: float 
+    voltage_filtered: float 
+    amp_hours: float 
+    amp_hours_charged: float 
+    watt_hours: float 
+    watt_hours_charged: float 
+    tachometer: float
+    tachometer_abs: float 
+    fault: int
+
+    @classmethod
+    def pack_values(cls, buffer, offset, values):
+        (id, temp_fet, temp_motor, avg_motor_current, avg_input_current,
+         avg_id, avg_iq, duty_cycle_now, rpm, voltage_filtered,
+         amp_hours, amp_hours_charged, watt_hours, watt_hours_charged,
+         tachometer, tachometer_abs, fault) = values
+        cls.PAYLOAD.pack_into(
+            buffer, offset,
+            id,
+            int(temp_fet * 10),
+            int(temp_motor * 10),
+            int(avg_motor_current * 100),
+            int(avg_input_current * 100),
+            int(avg_id),
+            int(avg_iq),
+            int(duty_cycle_now * 1000),
+            int(rpm),
+            int(voltage_filtered * 10),
+            int(amp_hours * 10000),
+            int(amp_hours_charged * 10000),
+            int(watt_hours * 10000),
+            int(watt_hours_charged * 10000),
+            int(tachometer),
+            int(tachometer_abs),
+            fault
+        )
+
+    @classmethod
+    def unpack_values(cls, buffer, offset=0):
+        (id, temp_fet, temp_motor, avg_motor_current, avg_input_current,
+         avg_id, avg_iq, duty_cycle_now, rpm, voltage_filtered,
+         amp_hours, amp_hours_charged, watt_hours, watt_hours_charged,
+         tachometer, tachometer_abs, fault) = cls.PAYLOAD.unpack_from(buffer, offset)
+        return (id, temp_fet / 10, temp_motor / 10, avg_motor_current / 100,
+                avg_input_current / 100, avg_id, avg_iq, duty_cycle_now / 1000,
+                rpm, voltage_filtered / 10, amp_hours / 10000, amp_hours_charged / 10000,
+                watt_hours / 10000, watt_hours_charged / 10000, tachometer, tachometer_abs, fault)
+
+@dataclass
+class COMM_CUSTOM_APP_DATA(Packet):
+    PAYLOAD: ClassVar[struct.Struct] = struct.Struct('>BBBBBbhhhBBB')
+
+    id: int
+    floatpkg: int
+    floatcmd: int
+    state: int
+    fault: int
+    pitch_or_duty_cycle: int
+    rpm: float
+    avgInputCurrent: float
+    inpVoltage: float
+    headlightBrightness: int
+    headlightIdleBrightness: int
+    statusbarBrightness: int
+
+    @classmethod
+    def pack_values(cls, buffer, offset, values):
+        (id, floatpkg, floatcmd, state, fault, pitch_or_duty_cycle, rpm,
+         avgInputCurrent, inpVoltage, headlightBrightness,
+         headlightIdleBrightness, statusbarBrightness) = values
+        cls.PAYLOAD.pack_into(
+            buffer, offset,
+            id,
+            floatpkg,
+            floatcmd,
+            state,
+            fault,
+            int(pitch_or_duty_cycle * 100),
+            int(rpm * 10),
+            int(avgInputCurrent * 100),
+            int(inpVoltage * 10),
+            headlightBrightness,
+            headlightIdleBrightness,
+            statusbarBrightness
+        )
+
+    @classmethod
+    def unpack_values(cls, buffer, offset=0):
+        (id, floatpkg, floatcmd, state, fault, pitch_or_duty_cycle, rpm,
+         avgInputCurrent, inpVoltage, headlightBrightness,
+         headlightIdleBrightness, statusbarBrightness) = cls.PAYLOAD.unpack_from(buffer, offset)
+        return (id, floatpkg, floatcmd, state, fault, pitch_or_duty_cycle / 100,
+                rpm / 10, avgInputCurrent / 100, inpVoltage / 10,
+                headlightBrightness, headlightIdleBrightness, statusbarBrightness)
+
+REPLY_PACKETS = {
+    commands.COMM_GET_VALUES: COMM_GET_VALUES,
+    commands.COMM_CUSTOM_APP_DATA: COMM_CUSTOM_APP_DATA,
+}
+
+def decode_reply(payload):
+    # One of our reply payloads back into a packet, read in place; None if
+    # it is not a reply packet or has the wrong length
+    if not len(payload):
+        return None
+    packet_class = REPLY_PACKETS.get(payload[0])
+    if packet_class is None or len(payload) != packet_class.PAYLOAD.size:
+        return None
+    return packet_class.from_payload(payload)
+
+def parse_reply(frame):
+    # As decode_reply, for a whole frame; None if the framing or CRC is wrong
+    payload = parse_frame(frame)
+    if payload is None:
+        return None
+    return decode_reply(payload)
@@ -0,0 +1,328 @@
+import argparse
+import bisect
+import math
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+# Open-circuit voltage of one li-ion cell against state of charge
+SOC_POINTS = np.array([0.0, 0.05, 0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0])
+CELL_VOLTAGES = np.array([3.0, 3.3, 3.45, 3.55, 3.62, 3.68, 3.74, 3.8, 3.88, 3.97, 4.07, 4.2])
+SOC_LIST = SOC_POINTS.tolist()
+CELL_VOLTAGE_LIST = CELL_VOLTAGES.tolist()
+GRAVITY = 9.81
+RPM_TO_RAD = 2.0 * math.pi / 60.0
+# Samples per second temperatures are worked out at for a whole ride; they
+# change slowly
+THERMAL_RATE = 10.0
+
+@dataclass
+class DriveParameters:
+    # Battery - 15S li-ion pack
+    cells: int = 15
+    capacity_ah: float = 4.0
+    internal_resistance: float = 0.15   # ohms, whole pack
+    # Hub motor; speeds and torques are at the wheel
+    kv: float = 18.0                    # RPM per volt of back-EMF
+    motor_resistance: float = 0.1       # ohms
+    current_limit: float = 60.0         # motor amps, either way
+    fet_resistance: float = 0.003       # ohms
+    tachometer_steps: float = 90.0      # per revolution: 6 per electrical revolution, 15 pole pairs
+    # Load
+    mass: float = 100.0                 # kg, board and rider
+    wheel_radius: float = 0.132         # m
+    rolling_resistance: float = 0.015
+    drag_area: float = 0.5              # m^2, drag coefficient times frontal area
+    air_density: float = 1.2            # kg/m^3
+    # First-order thermal model: degrees per watt at steady state, and time constants
+    ambient: float = 25.0
+    fet_thermal_resistance: float = 2.0
+    motor_thermal_resistance: float = 0.5
+    fet_time_constant: float = 60.0     # seconds
+    motor_time_constant: float = 300.0
+
+# These work on arrays (or plain floats) of any shape: devices in a fleet,
+# or samples in time when a scenario is compiled
+
+def load_constants(params):
+    # Motor amps per RPM/s of acceleration, for rolling resistance, and per
+    # RPM^2 of air drag
+    amps_per_newton = params.wheel_radius * params.kv * RPM_TO_RAD
+    inertia = params.mass * params.wheel_radius * RPM_TO_RAD * amps_per_newton
+    rolling = params.rolling_resistance * params.mass * GRAVITY * amps_per_newton
+    drag = 0.5 * params.air_density * params.drag_area * (RPM_TO_RAD * params.wheel_radius) ** 2 * amps_per_newton
+    return inertia, rolling, drag
+
+def motor_current(rpm, accel, params):
+    # Current for the torque that holds `rpm` while accelerating at `accel`
+    # RPM/s against inertia, rolling resistance and air drag, within the
+    # controller's current limit
+    # (the constants are folded first, so the arrays see few operations)
+    inertia, rolling, drag = load_constants(params)
+    current = inertia * accel + rolling * np.sign(rpm) + drag * rpm * np.abs(rpm)
+    return np.minimum(np.maximum(current, -params.current_limit), params.current_limit)
+
+def battery_current(rpm, current, open_circuit, params):
+    # The battery supplies the back-EMF and copper losses of the motor
+    # through its internal resistance: I_in * (V_oc - R * I_in) = P. Negative
+    # power (braking) charges it. Returns input current, terminal voltage
+    # and duty cycle.
+    motor_voltage = rpm / params.kv + current * params.motor_resistance
+    power = motor_voltage * current
+    resistance = params.internal_resistance
+    if resistance > 0:
+        discriminant = np.maximum(open_circuit * open_circuit - 4.0 * resistance * power, 0.0)
+        input_current = (open_circuit - np.sqrt(discriminant)) / (2.0 * resistance)
+    else:
+        input_current = power / np.maximum(open_circuit, 1e-3)
+    voltage = open_circuit - resistance * input_current
+    duty_cycle = np.minimum(np.maximum(motor_voltage / np.maximum(voltage, 1e-3), -1.0), 1.0)
+    return input_current, voltage, duty_cycle
+
+def motor_duty(rpm, current, voltage, params):
+    # Duty cycle and input current when the terminal voltage is given
+    motor_voltage = rpm / params.kv + current * params.motor_resistance
+    duty_cycle = np.minimum(np.maximum(motor_voltage / np.maximum(voltage, 1e-3), -1.0), 1.0)
+    return duty_cycle, duty_cycle * current
+
+def open_circuit_voltage(soc, params):
+    return params.cells * np.interp(soc, SOC_POINTS, CELL_VOLTAGES)
+
+def interp_float(x, xp, fp):
+    # np.interp() of one plain float over lists, without NumPy's call overhead
+    if x <= xp[0]:
+        return fp[0]
+    if x >= xp[-1]:
+        return fp[-1]
+    upper = bisect.bisect_right(xp, x)
+    lower = upper - 1
+    return fp[lower] + (fp[upper] - fp[lower]) * (x - xp[lower]) / (xp[upper] - xp[lower])
+
+# Whole rides are worked out at once from samples in time (ride profiles and
+# scenarios)
+
+def first_order(heating, time_constant, rate, ambient):
+    # Temperature of a first-order thermal mass heated `heating` degrees
+    # above ambient. Runs at the (low) thermal rate, so the recursion is a
+    # short Python loop.
+    alpha = 1.0 - np.exp(-1.0 / (time_constant * rate))
+    out = np.empty_like(heating)
+    temp = ambient
+    for i, target in enumerate((heating + ambient).tolist()):
+        temp += alpha * (target - temp)
+        out[i] = temp
+    return out
+
+def ride_temperatures(current, rate, params):
+    # FET and motor temperatures for motor current sampled at `rate` Hz,
+    # with I^2 averaged over each step of the thermal rate
+    count = len(current)
+    block = max(1, int(rate / THERMAL_RATE))
+    blocks = -(-count // block)
+    squared = np.zeros(blocks * block)
+    np.multiply(current, current, out=squared[:count])
+    heating = squared.reshape(blocks, block).mean(axis=1)
+    thermal_rate = rate / block
+    temp_fet = first_order(heating * (params.fet_resistance * params.fet_thermal_resistance),
+                           params.fet_time_constant, thermal_rate, params.ambient)
+    temp_motor = first_order(heating * (params.motor_resistance * params.motor_thermal_resistance),
+                             params.motor_time_constant, thermal_rate, params.ambient)
+    # Held for each thermal step; np.interp would cost more than all the above
+    return np.repeat(temp_fet, block)[:count], np.repeat(temp_motor, block)[:count]
+
+class Drivetrain:
+    # Battery, motor and FET state of `count` devices as arrays. step()
+    # advances every device with the same few array operations, so a fleet
+    # of 100 costs about what one device does. The models write their RPM
+    # into `rpm` and read their results back with rows(). A lone device
+    # (each model's own drivetrain) is stepped in plain floats instead, as
+    # NumPy's per-call overhead would dominate one-element arrays.
+    #
+    # The results are rows of one table, so rows() is a single conversion
+    TOTALS = ("amp_hours", "amp_hours_charged", "watt_hours", "watt_hours_charged",
+              "tachometer", "tachometer_abs")
+    RESULTS = ("duty_cycle", "motor_current", "input_current", "voltage", "open_circuit",
+               "temp_fet", "temp_motor") + TOTALS
+    # Rows a playing ride profile writes back: temperatures and totals
+    PROFILE_ROWS = slice(RESULTS.index("temp_fet"), len(RESULTS))
+    STATE = ("rpm", "last_rpm", "soc", "voltage_offset") + RESULTS
+
+    def __init__(self, count=1, params=None):
+        self.params = params if params is not None else DriveParameters()
+        self.count = count
+        self.rpm = np.zeros(count)
+        self.last_rpm = np.zeros(count)
+        self.soc = np.ones(count)
+        # Set voltages outside the SoC curve, e.g. by the voltage sweep, are
+        # kept as an offset from it
+        self.voltage_offset = np.zeros(count)
+        self.table = np.zeros((len(self.RESULTS), count))
+        for index, name in enumerate(self.RESULTS):
+            setattr(self, name, self.table[index])
+        self.temp_fet[:] = self.params.ambient
+        self.temp_motor[:] = self.params.ambient
+        self.open_circuit[:] = self.voltage[:] = self.rest_voltage()
+        self.thermal = None
+        self.scalar = None
+
+    def __len__(self):
+        return self.count
+
+    def rest_voltage(self):
+        return open_circuit_voltage(self.soc, self.params) + self.voltage_offset
+
+    def set_open_circuit(self, index, voltage):
+        # Rest voltage of one battery, e.g. from the GUI: the SoC that gives
+        # it, plus whatever the curve cannot reach
+        cells = self.params.cells
+        soc = interp_float(voltage / cells, CELL_VOLTAGE_LIST, SOC_LIST)
+        self.soc[index] = soc
+        self.voltage_offset[index] = voltage - cells * interp_float(soc, SOC_LIST, CELL_VOLTAGE_LIST)
+
+    def thermal_constants(self, dt):
+        # Column vectors for the FET and motor rows, cached per dt
+        cached = self.thermal
+        if cached is None or cached[0] != dt:
+            params = self.params
+            heating = np.array([[params.fet_resistance * params.fet_thermal_resistance],
+                                [params.motor_resistance * params.motor_thermal_resistance]])
+            alpha = 1.0 - np.exp(-dt / np.array([[params.fet_time_constant], [params.motor_time_constant]]))
+            cached = self.thermal = (dt, heating, alpha)
+        return cached[1], cached[2]
+
+    def copy_device(self, index, source, source_index):
+        for name in self.STATE:
+            getattr(self, name)[index] = getattr(source, name)[source_index]
+
+    def scalar_constants(self, dt):
+        # thermal_constants() and the load constants as floats, cached per dt
+        cached = self.scalar
+        if cached is None or cached[0] != dt:
+            heating, alpha = self.thermal_constants(dt)
+            cached = self.scalar = (dt, *heating[:, 0].tolist(), *alpha[:, 0].tolist(),
+                                    *load_constants(self.params))
+        return cached[1:]
+
+    def step(self, dt):
+        if self.count == 1:
+            self.step_one(dt)
+            return
+        params = self.params
+        rpm = self.rpm
+        accel = (rpm - self.last_rpm) / dt
+        self.last_rpm[:] = rpm
+
+        current = motor_current(rpm, accel, params)
+        open_circuit = self.rest_voltage()
+        input_current, voltage, duty_cycle = battery_current(rpm, current, open_circuit, params)
+        self.duty_cycle[:] = duty_cycle
+        self.motor_current[:] = current
+        self.input_current[:] = input_current
+        self.voltage[:] = voltage
+        self.open_circuit[:] = open_circuit
+
+        # Charge and energy this step, discharging or regenerating
+        charge = input_current * (dt / 3600.0)
+        energy = charge * voltage
+        self.amp_hours += np.maximum(charge, 0.0)
+        self.amp_hours_charged -= np.minimum(charge, 0.0)
+        self.watt_hours += np.maximum(energy, 0.0)
+        self.watt_hours_charged -= np.minimum(energy, 0.0)
+        soc = self.soc
+        soc -= charge / params.capacity_ah
+        np.maximum(soc, 0.0, out=soc)
+        np.minimum(soc, 1.0, out=soc)
+
+        steps = rpm * (dt / 60.0 * params.tachometer_steps)
+        self.tachometer += steps
+        self.tachometer_abs += np.abs(steps)
+
+        # I^2 R losses heat the FETs and motor (adjacent rows of the table)
+        # towards ambient + P * R_thermal
+        temperatures = self.table[5:7]
+        heating, alpha = self.thermal_constants(dt)
+        temperatures += alpha * (heating * (current * current) + params.ambient - temperatures)
+
+    def step_one(self, dt):
+        # step() for a single device, spelled out in floats
+        params = self.params
+        fet_heating, motor_heating, fet_alpha, motor_alpha, inertia, rolling, drag = self.scalar_constants(dt)
+        rpm = self.rpm.item(0)
+        accel = (rpm - self.last_rpm.item(0)) / dt
+        self.last_rpm[0] = rpm
+        (_, _, _, _, _, temp_fet, temp_motor, amp_hours, amp_hours_charged, watt_hours,
+         watt_hours_charged, tachometer, tachometer_abs) = self.table[:, 0].tolist()
+
+        current = inertia * accel + drag * rpm * abs(rpm)
+        if rpm:
+            current += math.copysign(rolling, rpm)
+        current = min(max(current, -params.current_limit), params.current_limit)
+
+        soc = self.soc.item(0)
+        open_circuit = (params.cells * interp_float(soc, SOC_LIST, CELL_VOLTAGE_LIST)
+                        + self.voltage_offset.item(0))
+        motor_voltage = rpm / params.kv + current * params.motor_resistance
+        power = motor_voltage * current
+        resistance = params.internal_resistance
+        if resistance > 0:
+            discriminant = max(open_circuit * open_circuit - 4.0 * resistance * power, 0.0)
+            input_current = (open_circuit - math.sqrt(discriminant)) / (2.0 * resistance)
+        else:
+            input_current = power / max(open_circuit, 1e-3)
+        voltage = open_circuit - resistance * input_current
+        duty_cycle = min(max(motor_voltage / max(voltage, 1e-3), -1.0), 1.0)
+
+        charge = input_current * (dt / 3600.0)
+        energy = charge * voltage
+        if charge > 0:
+            amp_hours += charge
+            watt_hours += energy
+        else:
+            amp_hours_charged -= charge
+            watt_hours_charged -= energy
+        self.soc[0] = min(max(soc - charge / params.capacity_ah, 0.0), 1.0)
+
+        steps = rpm * (dt / 60.0 * params.tachometer_steps)
+        tachometer += steps
+        tachometer_abs += abs(steps)
+
+        squared = current * current
+        temp_fet += fet_alpha * (fet_heating * squared + params.ambient - temp_fet)
+        temp_motor += motor_alpha * (motor_heating * squared + params.ambient - temp_motor)
+
+        self.table[:, 0] = (duty_cycle, current, input_current, voltage, open_circuit, temp_fet, temp_motor,
+                            amp_hours, amp_hours_charged, watt_hours, watt_hours_charged, tachometer,
+                            tachometer_abs)
+
+    def rows(self):
+        # One list per device, in RESULTS order
+        return self.table.T.tolist()
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the vectorised drivetrain model")
+    parser.add_argument("-n", "--devices", help="number of devices", type=int, default=100)
+    parser.add_argument("-s", "--steps", help="steps to time", type=int, default=10000)
+    parser.add_argument("--dt", help="seconds per step", type=float, default=0.01)
+    args = parser.parse_args()
+
+    drive = Drivetrain(args.devices)
+    ramp = np.linspace(0.0, 900.0, args.devices)
+    start = time.perf_counter()
+    for i in range(args.steps):
+        drive.rpm[:] = ramp * min(1.0, i * args.dt / 10.0)
+        drive.step(args.dt)
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    drive.rows()
+    rows_elapsed = time.perf_counter() - start
+    print("{} devices: {:.1f} us per step, {:.1f} us to read the results back".format(
+        args.devices, elapsed / args.steps * 1e6, rows_elapsed * 1e6))
+    print("after {:.0f} s at {:.0f} RPM: {:.1f} A motor, {:.1f} A battery, {:.2f} V, duty {:.2f}, "
+          "{:.3f} Ah, {:.1f} Wh, temp_fet {:.1f} C, temp_motor {:.1f} C".format(
+              args.steps * args.dt, drive.rpm[-1], drive.motor_current[-1], drive.input_current[-1], drive.voltage[-1],
+              drive.duty_cycle[-1],
+              drive.amp_hours[-1], drive.watt_hours[-1], drive.temp_fet[-1], drive.temp_motor[-1]))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+import os
+import select
+import time
+
+from protocol import FrameDecoder
+
+class Poller:
+    # Synthetic LCM on one end of a pty: writes requests and decodes the
+    # replies (as payloads) as they come back
+    def __init__(self, fd):
+        self.fd = fd
+        self.decoder = FrameDecoder()
+        self.replies = []
+        # Replies skipped by poll() as late answers to earlier requests
+        self.stale = 0
+
+    def wait_reply(self, timeout, command=None):
+        # The next reply, or with `command` the next reply to that command
+        deadline = time.perf_counter() + timeout
+        while True:
+            while self.replies:
+                reply = self.replies.pop(0)
+                if command is None or (len(reply) and reply[0] == command):
+                    return reply
+                self.stale += 1
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return None
+            if select.select([self.fd], [], [], remaining)[0]:
+                self.replies.extend(self.decoder.feed(os.read(self.fd, 4096)))
+
+    def poll(self, request, timeout=1.0):
+        # `request` is a whole frame; a reply that arrives after an earlier
+        # poll timed out is skipped rather than taken as the answer to this one
+        os.write(self.fd, request)
+        return self.wait_reply(timeout, request[2])
+
+    def run(self, request, duration, depth=1):
+        # Keep `depth` polls in flight for `duration` seconds
+        sent = []
+        latencies = []
+        reply_size = 0
+        lost = 0
+        end = time.perf_counter() + duration
+        while len(sent) < depth:
+            sent.append(time.perf_counter())
+            os.write(self.fd, request)
+        while time.perf_counter() < end:
+            reply = self.wait_reply(1.0)
+            now = time.perf_counter()
+            if reply is None:
+                lost += len(sent)
+                sent.clear()
+            else:
+                latencies.append(now - sent.pop(0))
+                reply_size = len(reply) + 5
+            while len(sent) < depth:
+                sent.append(time.perf_counter())
+                os.write(self.fd, request)
+        # Drain what is still in flight so the next run starts clean
+        while sent and self.wait_reply(0.5) is not None:
+            sent.pop(0)
+        self.replies.clear()
+        return latencies, reply_size, lost
+
+def percentile(values, q):
+    return values[min(len(values) - 1, int(len(values) * q))]
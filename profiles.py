@@ -0,0 +1,123 @@
+import argparse
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+from physics import (THERMAL_RATE, DriveParameters, battery_current, motor_current, open_circuit_voltage,
+                     ride_temperatures)
+
+@dataclass
+class Segment:
+    # Ramp linearly to `rpm` over `duration` seconds. A cruise segment just
+    # repeats the previous target; braking ramps to 0, reversing below it.
+    name: str
+    duration: float
+    rpm: float
+
+def accelerate(duration, rpm):
+    return Segment("accelerate", duration, rpm)
+
+def cruise(duration, rpm):
+    return Segment("cruise", duration, rpm)
+
+def brake(duration):
+    return Segment("brake", duration, 0.0)
+
+def reverse(duration, rpm):
+    return Segment("reverse", duration, -abs(rpm))
+
+def idle(duration):
+    return Segment("idle", duration, 0.0)
+
+@dataclass
+class RideProfile:
+    rate: float
+    rpm: np.ndarray
+    duty_cycle: np.ndarray
+    motor_current: np.ndarray
+    input_current: np.ndarray
+    voltage: np.ndarray
+    temp_fet: np.ndarray
+    temp_motor: np.ndarray
+    # Optional RunState values and fault codes (scenarios)
+    state: Optional[np.ndarray] = None
+    fault: Optional[np.ndarray] = None
+
+    def __len__(self):
+        return len(self.rpm)
+
+    @property
+    def duration(self):
+        return len(self.rpm) / self.rate
+
+def generate_profile(segments, rate=1000.0, params=None):
+    params = params if params is not None else DriveParameters()
+
+    # RPM: piecewise linear between the segment end points
+    durations = np.array([segment.duration for segment in segments], dtype=np.float64)
+    ends = np.cumsum(durations)
+    targets = []
+    previous = 0.0
+    for segment in segments:
+        previous = previous if segment.name == "cruise" else segment.rpm
+        targets.append(previous)
+    knot_times = np.concatenate(([0.0], ends))
+    knot_rpm = np.concatenate(([0.0], targets))
+    count = int(round(ends[-1] * rate))
+    t = np.arange(count, dtype=np.float64) / rate
+    rpm = np.interp(t, knot_times, knot_rpm)
+
+    # Motor current from the drivetrain model, for the torque the ride needs
+    accel = np.gradient(rpm, 1.0 / rate)
+    current = motor_current(rpm, accel, params)
+
+    # Battery: the charge drawn from a full pack gives the state of charge
+    # along the ride, and that the open-circuit voltage it sags from. The
+    # charge changes slowly, so it is worked out at the thermal rate.
+    step = max(1, int(rate / THERMAL_RATE))
+    coarse, _, _ = battery_current(rpm[::step], current[::step], open_circuit_voltage(1.0, params), params)
+    used_ah = np.cumsum(coarse) * (step / (rate * 3600.0))
+    soc = np.clip(1.0 - used_ah / params.capacity_ah, 0.0, 1.0)
+    open_circuit = np.repeat(open_circuit_voltage(soc, params), step)[:count]
+    input_current, voltage, duty = battery_current(rpm, current, open_circuit, params)
+
+    temp_fet, temp_motor = ride_temperatures(current, rate, params)
+    return RideProfile(rate, rpm, duty, current, input_current, voltage, temp_fet, temp_motor)
+
+def default_ride(duration=600.0):
+    # Repeat a short ride loop until `duration` seconds are covered
+    loop = [
+        accelerate(5.0, 600.0),
+        cruise(20.0, 600.0),
+        accelerate(3.0, 850.0),
+        cruise(10.0, 850.0),
+        brake(4.0),
+        idle(3.0),
+        reverse(3.0, 200.0),
+        brake(2.0),
+        idle(5.0),
+    ]
+    loop_duration = sum(segment.duration for segment in loop)
+    repeats = max(1, int(np.ceil(duration / loop_duration)))
+    return loop * repeats
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the ride profile generator")
+    parser.add_argument("-d", "--duration", help="profile length in seconds", type=float, default=3600.0)
+    parser.add_argument("-r", "--rate", help="samples per second", type=float, default=1000.0)
+    args = parser.parse_args()
+
+    segments = default_ride(args.duration)
+    start = time.perf_counter()
+    profile = generate_profile(segments, args.rate)
+    elapsed = time.perf_counter() - start
+    print("{} samples ({:.0f} s at {:.0f} Hz) in {:.3f} s".format(
+        len(profile), profile.duration, profile.rate, elapsed))
+    print("rpm {:.0f}..{:.0f}, voltage {:.2f}..{:.2f} V, temp_fet max {:.1f} C, temp_motor max {:.1f} C".format(
+        profile.rpm.min(), profile.rpm.max(), profile.voltage.min(), profile.voltage.max(),
+        profile.temp_fet.max(), profile.temp_motor.max()))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import struct
+from dataclasses import dataclass
+
+import crc
+
+FRAME_START = 0x02
+FRAME_END = 0x03
+# Start byte, length byte, two CRC bytes and end byte around the payload
+FRAME_OVERHEAD = 5
+FRAME_HEADER = struct.Struct('>BB')
+FRAME_TRAILER = struct.Struct('>HB')
+
+def frame_into(buffer, payload_length):
+    # The payload is already at offset 2; write the framing around it in place
+    end = 2 + payload_length
+    FRAME_HEADER.pack_into(buffer, 0, FRAME_START, payload_length)
+    FRAME_TRAILER.pack_into(buffer, end, crc.crc16(memoryview(buffer)[2:end]), FRAME_END)
+    return end + 3
+
+def encode_frame(payload) -> bytearray:
+    buffer = bytearray(len(payload) + FRAME_OVERHEAD)
+    buffer[2:2 + len(payload)] = payload
+    frame_into(buffer, len(payload))
+    return buffer
+
+def parse_frame(data):
+    # Returns the payload as a memoryview into `data` (no copy), or None
+    if len(data) < 6:
+        return None  # invalid frame length
+    view = memoryview(data)
+    if view[0] != FRAME_START:
+        return None  # invalid start byte
+    length = view[1]
+    if len(view) != length + FRAME_OVERHEAD:
+        return None  # invalid frame length
+    frame_crc, end = FRAME_TRAILER.unpack_from(view, 2 + length)
+    if end != FRAME_END:
+        return None  # invalid end byte
+    payload = view[2:2 + length]
+    calculated_crc = crc.crc16(payload)
+    if frame_crc != calculated_crc:
+        print("Invalid CRC16: recieved 0x{:04x}, calculated 0x{:04x}".format(frame_crc, calculated_crc))
+        return None  # invalid CRC16
+    return payload
+
+@dataclass
+class DecoderStats:
+    bytes_received: int = 0
+    frames_decoded: int = 0
+    resync_bytes: int = 0
+    bad_lengths: int = 0
+    bad_end_bytes: int = 0
+    crc_failures: int = 0
+    # Times a caller still held a view of an earlier frame, so the buffer
+    # could not be resized in place and was copied instead
+    buffer_copies: int = 0
+
+class FrameDecoder:
+    def __init__(self):
+        # Receive buffer; consumed bytes are dropped from the front, which
+        # bytearray does in place without moving the remaining data
+        self.buffer = bytearray()
+        self.stats = DecoderStats()
+
+    def read_from(self, ser):
+        # Block for at least one byte (bounded by the port timeout), then
+        # drain everything the driver has already buffered in one read
+        data = ser.read(ser.in_waiting or 1)
+        if not data:
+            return iter(())
+        return self.frames(data)
+
+    def feed(self, data):
+        # Decoded payloads as bytes, for callers that keep them
+        return [bytes(frame) for frame in self.frames(data)]
+
+    def frames(self, data):
+        # Yields each complete payload as a memoryview into the receive
+        # buffer, without copying it. A view is only valid until the next
+        # one is requested: copy (bytes(frame)) anything that must outlive
+        # that, as the consumed bytes are then dropped from the buffer.
+        # A caller that keeps one anyway (e.g. a slice of it) pins the
+        # buffer's size; the decoder then moves on to a copy of the buffer
+        # and leaves the old one to the caller.
+        buffer = self.buffer
+        stats = self.stats
+        try:
+            buffer += data
+        except BufferError:
+            buffer = self.buffer = buffer + data
+            stats.buffer_copies += 1
+        stats.bytes_received += len(data)
+
+        pos = 0
+        end = len(buffer)
+        view = memoryview(buffer)
+        try:
+            while True:
+                start = buffer.find(FRAME_START, pos)
+                if start < 0:
+                    stats.resync_bytes += end - pos
+                    pos = end
+                    break
+                stats.resync_bytes += start - pos
+                pos = start
+                if end - pos < 2:
+                    break  # wait for the length byte
+                length = buffer[pos + 1]
+                if length == 0:
+                    # Not a frame start, skip it and hunt for the next one
+                    stats.bad_lengths += 1
+                    stats.resync_bytes += 1
+                    pos += 1
+                    continue
+                frame_end = pos + length + FRAME_OVERHEAD
+                if frame_end > end:
+                    break  # wait for the rest of the frame
+                frame_crc, end_byte = FRAME_TRAILER.unpack_from(view, frame_end - 3)
+                if end_byte != FRAME_END:
+                    stats.bad_end_bytes += 1
+                    stats.resync_bytes += 1
+                    pos += 1
+                    continue
+                payload = view[pos + 2:frame_end - 3]
+                if crc.crc16(payload) != frame_crc:
+                    payload.release()
+                    stats.crc_failures += 1
+                    stats.resync_bytes += 1
+                    pos += 1
+                    continue
+                stats.frames_decoded += 1
+                # Count the frame as consumed even if the caller stops here
+                pos = frame_end
+                try:
+                    yield payload
+                finally:
+                    payload.release()
+        finally:
+            view.release()
+            try:
+                del buffer[:pos]
+            except BufferError:
+                self.buffer = buffer[pos:]
+                stats.buffer_copies += 1
+
+@dataclass
+class WriterStats:
+    writes: int = 0
+    frames: int = 0
+    bytes_written: int = 0
+
+class ReplyWriter:
+    # Collects the replies to the frames of one read and hands them to the
+    # port in a single write. The buffer is reused, so steady state polling
+    # allocates nothing; `flush` (e.g. ser.flush) waits for the bytes to
+    # leave the port after each write.
+    def __init__(self, write, flush=None, size=1024):
+        self.write = write
+        self.flush = flush
+        self.buffer = bytearray(size)
+        self.length = 0
+        self.stats = WriterStats()
+
+    def add(self, reply):
+        end = self.length + len(reply)
+        if end > len(self.buffer):
+            self.buffer.extend(bytes(max(end - len(self.buffer), len(self.buffer))))
+        self.buffer[self.length:end] = reply
+        self.length = end
+        self.stats.frames += 1
+
+    def send(self):
+        if not self.length:
+            return
+        stats = self.stats
+        stats.writes += 1
+        stats.bytes_written += self.length
+        with memoryview(self.buffer) as view:
+            self.write(view[:self.length])
+        self.length = 0
+        if self.flush is not None:
+            self.flush()
@@ -0,0 +1,323 @@
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import shlex
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tty
+
+from commands import COMM_CUSTOM_APP_DATA, COMM_GET_VALUES, FLOAT_COMMAND_LCM_POLL, FLOAT_PACKAGE_ID
+from engine import RunState
+from dispatch import default_dispatcher
+from fleet import Fleet, PtyLink, SimulatedDevice
+from metrics import Metrics
+from packets import REPLY_PACKETS, decode_reply
+from poller import Poller, percentile
+from protocol import encode_frame
+from scenario import compile_scenario, load_scenario
+from scheduler import MAX_RATE
+
+# Everything a worker needs is imported here, before the pool forks, so a
+# worker starts without importing anything; none of these modules parse
+# argv, open a port or create a Tk root at import time.
+
+SCENARIO_EXTENSIONS = (".json", ".toml", ".yaml", ".yml")
+REQUESTS = (
+    bytes(encode_frame(bytes([COMM_GET_VALUES]))),
+    bytes(encode_frame(bytes([COMM_CUSTOM_APP_DATA, FLOAT_PACKAGE_ID, FLOAT_COMMAND_LCM_POLL]))),
+)
+# Output kept from an external LCM process when its run fails
+OUTPUT_TAIL = 20
+
+def check_reply(request, reply):
+    # The decoded reply from the simulated VESC and None, or None and the
+    # problem with it
+    if reply is None:
+        return None, "no reply"
+    if not len(reply) or reply[0] != request[2]:
+        return None, "reply to the wrong command"
+    packet = decode_reply(reply)
+    if packet is None:
+        return None, "reply is {} bytes, expected {}".format(len(reply), REPLY_PACKETS[request[2]].PAYLOAD.size)
+    return packet, None
+
+def expected_events(scenario, duration, poll_rate):
+    # States and faults the poller must see: those set within the run that
+    # hold for a few rounds of polls. Shorter ones may fall between polls.
+    window = 2 * len(REQUESTS) / poll_rate
+    end = min(duration, scenario.duration)
+    expected = []
+    for events in (scenario.state_events, scenario.fault_events):
+        found = set()
+        for index, (when, value) in enumerate(events):
+            until = events[index + 1][0] if index + 1 < len(events) else scenario.duration
+            if min(until, end) - when >= window:
+                found.add(value)
+        expected.append(found)
+    return expected
+
+def poll_lcm(link, duration, poll_rate, stop_event, result):
+    # Synthetic LCM on the slave side: alternates GET_VALUES and LCM_POLL
+    # at `poll_rate` and checks every reply
+    fd = os.open(link.slave_name, os.O_RDWR | os.O_NOCTTY)
+    tty.setraw(fd)
+    poller = Poller(fd)
+    latencies = []
+    states = set()
+    faults = set()
+    interval = 1.0 / poll_rate
+    next_poll = time.perf_counter()
+    end = next_poll + duration
+    count = 0
+    try:
+        while not stop_event.is_set() and next_poll < end:
+            request = REQUESTS[count % len(REQUESTS)]
+            count += 1
+            sent = time.perf_counter()
+            reply = poller.poll(request, 1.0)
+            packet, problem = check_reply(request, reply)
+            if problem is None:
+                latencies.append(time.perf_counter() - sent)
+                faults.add(packet.fault)
+                if reply[0] == COMM_CUSTOM_APP_DATA:
+                    states.add(packet.state)
+            elif problem == "no reply":
+                result["lost"] += 1
+            else:
+                result["invalid"] += 1
+                if len(result["failures"]) < 10:
+                    result["failures"].append(problem)
+            next_poll += interval
+            delay = next_poll - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    finally:
+        os.close(fd)
+    # Each poll that timed out may be answered late; anything beyond that
+    # answered a request that was never sent
+    if poller.stale > result["lost"]:
+        result["invalid"] += poller.stale - result["lost"]
+        result["failures"].append("{} replies to the wrong command".format(poller.stale - result["lost"]))
+    latencies.sort()
+    result["polls"] = len(latencies)
+    if latencies:
+        result["rtt_p50_us"] = statistics.median(latencies) * 1e6
+        result["rtt_p99_us"] = percentile(latencies, 0.99) * 1e6
+        result["rtt_max_us"] = latencies[-1] * 1e6
+    result["states_seen"] = sorted(states)
+    result["faults_seen"] = sorted(faults)
+
+def run_lcm(command, link, duration, stall_timeout, metrics, result):
+    # External LCM (e.g. the firmware built for the host) pointed at the
+    # pty; it is stopped after `duration` and fails the run if it exits
+    # early, fails, or stops polling for `stall_timeout` seconds
+    argv = shlex.split(command.format(port=link.slave_name))
+    process = subprocess.Popen(argv, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    output = []
+    reader = threading.Thread(target=lambda: output.extend(process.stdout), daemon=True)
+    reader.start()
+    end = time.monotonic() + duration
+    last_frames = 0
+    last_change = time.monotonic()
+    while time.monotonic() < end and process.poll() is None:
+        time.sleep(0.05)
+        now = time.monotonic()
+        if metrics.frames != last_frames:
+            last_frames = metrics.frames
+            last_change = now
+        elif now - last_change > stall_timeout:
+            result["failures"].append("LCM stopped polling for {:.1f} s".format(now - last_change))
+            break
+    if process.poll() is None:
+        process.terminate()
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+    else:
+        result["lcm_exit"] = process.returncode
+        if process.returncode != 0:
+            result["failures"].append("LCM exited with status {}".format(process.returncode))
+        elif time.monotonic() < end:
+            result["failures"].append("LCM exited early")
+    reader.join(1.0)
+    if result["failures"]:
+        result["lcm_output"] = [line.decode(errors="replace").rstrip() for line in output[-OUTPUT_TAIL:]]
+
+def run_scenario(task):
+    # One run in a worker process: its own pty, device and fleet thread
+    path, run, options = task
+    result = {
+        "scenario": path,
+        "run": run,
+        "pid": os.getpid(),
+        "polls": 0,
+        "lost": 0,
+        "invalid": 0,
+        "failures": [],
+    }
+    started = time.monotonic()
+    fleet = None
+    thread = None
+    try:
+        scenario = load_scenario(path)
+        result["name"] = scenario.name
+        duration = scenario.duration if options["duration"] is None else options["duration"]
+
+        metrics = Metrics()
+        default_dispatcher.metrics = metrics
+        fleet = Fleet(options["tick_rate"])
+        device = fleet.add(SimulatedDevice(PtyLink(), metrics=metrics))
+        device.model.play_profile(compile_scenario(scenario), loop=scenario.loop)
+        thread = threading.Thread(target=fleet.run, daemon=True)
+        thread.start()
+
+        if options["lcm"]:
+            run_lcm(options["lcm"], device.link, duration, options["stall_timeout"], metrics, result)
+        else:
+            poll_lcm(device.link, duration, options["poll_rate"], fleet.stop_event, result)
+            if not result["polls"]:
+                result["failures"].append("no valid replies")
+            elif result["lost"]:
+                result["failures"].append("{} polls went unanswered".format(result["lost"]))
+            states, faults = expected_events(scenario, duration, options["poll_rate"])
+            for state in sorted(states - set(result["states_seen"])):
+                result["failures"].append("{} never seen".format(RunState(state).name))
+            for fault in sorted(faults - set(result["faults_seen"])):
+                result["failures"].append("fault {} never seen".format(fault))
+
+        fleet.stop()
+        thread.join(2.0)
+        result["frames"] = metrics.frames
+        result["replies"] = metrics.replies
+        result["decoder"] = vars(device.decoder.stats).copy()
+        result["handle_p99_us"] = {label: histogram.quantile(0.99) * 1e6
+                                   for (stage, label), histogram in metrics.histograms.items()
+                                   if stage == "total"}
+        result["ticks"] = fleet.scheduler.stats.steps
+        if device.errors:
+            result["failures"].append("{} errors handling frames, see the log".format(device.errors))
+    except Exception as e:
+        result["failures"].append("{}: {}".format(type(e).__name__, e))
+    finally:
+        if fleet is not None:
+            fleet.stop()
+            if thread is not None:
+                thread.join(2.0)
+            fleet.close()
+        default_dispatcher.metrics = None
+    result["seconds"] = time.monotonic() - started
+    result["ok"] = not result["failures"]
+    return result
+
+def find_scenarios(paths):
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found += sorted(p for p in glob.glob(os.path.join(path, "*"))
+                            if p.lower().endswith(SCENARIO_EXTENSIONS))
+        else:
+            found.append(path)
+    return found
+
+def summary_line(result):
+    parts = []
+    if "states_seen" in result:
+        parts.append("{} polls".format(result["polls"]))
+    if "rtt_p99_us" in result:
+        parts.append("rtt p50 {:.0f} us p99 {:.0f} us".format(result["rtt_p50_us"], result["rtt_p99_us"]))
+    if "frames" in result:
+        parts.append("{} frames served".format(result["frames"]))
+    parts.append("{:.1f} s".format(result["seconds"]))
+    line = "{} {} #{}: {}".format("PASS" if result["ok"] else "FAIL",
+                                  result.get("name", result["scenario"]), result["run"], ", ".join(parts))
+    for failure in result["failures"]:
+        line += "\n    " + failure
+    for output in result.get("lcm_output", []):
+        line += "\n    | " + output
+    return line
+
+def main():
+    parser = argparse.ArgumentParser(description="Run scenarios against simulated VESCs in parallel worker processes")
+    parser.add_argument("scenarios", nargs="+", help="scenario files, or directories of them")
+    parser.add_argument("-j", "--jobs", help="worker processes (default: one per core)",
+                        type=int, default=os.cpu_count())
+    parser.add_argument("-n", "--repeat", help="runs of each scenario", type=int, default=1)
+    parser.add_argument("-d", "--duration", help="seconds per run (default: the scenario's length)",
+                        type=float, default=None)
+    parser.add_argument("--tick-rate", help="model ticks per second (up to 1000)", type=float, default=100.0)
+    parser.add_argument("--poll-rate", help="synthetic LCM polls per second", type=float, default=50.0)
+    parser.add_argument("--lcm", help="run this LCM command per run instead of the synthetic poller; "
+                        "{port} is replaced with the pty", default=None)
+    parser.add_argument("--stall-timeout", help="fail an --lcm run that stops polling for this long",
+                        type=float, default=2.0)
+    parser.add_argument("-o", "--output", help="write the per-run results as JSON here", default=None)
+    args = parser.parse_args()
+    if not 0 < args.tick_rate <= MAX_RATE:
+        parser.error("--tick-rate must be above 0 and at most {:.0f}".format(MAX_RATE))
+    if not args.poll_rate > 0:
+        parser.error("--poll-rate must be above 0")
+
+    paths = find_scenarios(args.scenarios)
+    if not paths:
+        raise SystemExit("No scenario files found")
+    # Fail fast on a broken file rather than in every worker
+    for path in paths:
+        try:
+            load_scenario(path)
+        except (OSError, ValueError) as e:
+            raise SystemExit("{}: {}".format(path, e))
+
+    options = {
+        "duration": args.duration,
+        "tick_rate": args.tick_rate,
+        "poll_rate": args.poll_rate,
+        "lcm": args.lcm,
+        "stall_timeout": args.stall_timeout,
+    }
+    tasks = [(path, run, options) for path in paths for run in range(1, args.repeat + 1)]
+    jobs = max(1, min(args.jobs, len(tasks)))
+    print("Running {} scenario runs on {} workers".format(len(tasks), jobs))
+
+    # Forked workers inherit the imported modules, so they start at once
+    context = multiprocessing.get_context("fork")
+    results = []
+    started = time.monotonic()
+    with context.Pool(jobs) as pool:
+        for result in pool.imap_unordered(run_scenario, tasks):
+            results.append(result)
+            print(summary_line(result))
+    elapsed = time.monotonic() - started
+
+    results.sort(key=lambda result: (result["scenario"], result["run"]))
+    failed = [result for result in results if not result["ok"]]
+    frames = sum(result.get("frames", 0) for result in results)
+    print("{} runs, {} passed, {} failed; {} frames served in {:.1f} s".format(
+        len(results), len(results) - len(failed), len(failed), frames, elapsed))
+    for result in failed:
+        print("  failed: {} #{}".format(result["scenario"], result["run"]))
+
+    if args.output:
+        report = {
+            "python": sys.version.split()[0],
+            "jobs": jobs,
+            "seconds": elapsed,
+            "options": options,
+            "passed": len(results) - len(failed),
+            "failed": len(failed),
+            "results": results,
+        }
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+            f.write("\n")
+    if failed:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
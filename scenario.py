@@ -0,0 +1,233 @@
+import argparse
+import json
+import os
+import time
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from engine import RunState
+from physics import DriveParameters, motor_current, motor_duty, ride_temperatures
+from profiles import RideProfile
+
+# Scenario files describe timed keyframes per quantity plus discrete events:
+#
+#   {
+#     "name": "hard brake",
+#     "rate": 1000,
+#     "loop": false,
+#     "tracks": {
+#       "rpm": [[0, 0], [5, 800, "smooth"], [8, 800], [9, 0, "linear"]],
+#       "voltage": [[0, 60], [9, 57]]
+#     },
+#     "events": [
+#       {"time": 0, "state": "STATE_STARTUP"},
+#       {"time": 1, "state": "STATE_RUNNING"},
+#       {"time": 8.5, "fault": 6}
+#     ]
+#   }
+#
+# A keyframe is [time, value] or [time, value, interpolation], where the
+# interpolation ("linear", "step" or "smooth") applies from the previous
+# keyframe. JSON, TOML and (with PyYAML installed) YAML files are accepted.
+
+TRACKS = ("rpm", "duty_cycle", "motor_current", "input_current", "voltage", "temp_fet", "temp_motor")
+INTERPOLATIONS = {"linear": 0, "step": 1, "smooth": 2}
+# Largest magnitude of each track the replies can carry: the narrowest field
+# it is packed into, over that field's scale
+TRACK_LIMITS = {
+    "rpm": 32767 / 10,              # LCM poll, int16 of RPM x 10
+    "duty_cycle": 127 / 100,        # LCM poll, int8 of duty x 100
+    "motor_current": 2147483647 / 100,
+    "input_current": 32767 / 100,   # LCM poll, int16 of amps x 100
+    "voltage": 32767 / 10,
+    "temp_fet": 32767 / 10,
+    "temp_motor": 32767 / 10,
+}
+DEFAULTS = {
+    "rpm": 0.0,
+    "voltage": 60.0,
+}
+
+@dataclass
+class Track:
+    times: np.ndarray
+    values: np.ndarray
+    modes: np.ndarray     # interpolation into each keyframe from the one before
+
+@dataclass
+class Scenario:
+    name: str
+    rate: float
+    duration: float
+    loop: bool
+    tracks: dict
+    state_events: list = field(default_factory=list)   # (time, state)
+    fault_events: list = field(default_factory=list)   # (time, fault code)
+
+def parse_track(name, keyframes):
+    if not keyframes:
+        raise ValueError("Track '{}' has no keyframes".format(name))
+    times = []
+    values = []
+    modes = []
+    for keyframe in keyframes:
+        if isinstance(keyframe, dict):
+            keyframe = [keyframe["time"], keyframe["value"], keyframe.get("interpolation", "linear")]
+        if len(keyframe) not in (2, 3):
+            raise ValueError("Track '{}': keyframes are [time, value] or [time, value, interpolation]".format(name))
+        mode = keyframe[2] if len(keyframe) == 3 else "linear"
+        if mode not in INTERPOLATIONS:
+            raise ValueError("Track '{}': unknown interpolation '{}'".format(name, mode))
+        times.append(float(keyframe[0]))
+        values.append(float(keyframe[1]))
+        modes.append(INTERPOLATIONS[mode])
+    times = np.array(times)
+    if np.any(np.diff(times) < 0):
+        raise ValueError("Track '{}': keyframe times must not decrease".format(name))
+    # Every interpolation stays between its keyframes
+    limit = TRACK_LIMITS[name]
+    for value in values:
+        if not -limit <= value <= limit:
+            raise ValueError("Track '{}': {} is out of range, expected -{:g} to {:g}".format(name, value, limit, limit))
+    return Track(times, np.array(values), np.array(modes, dtype=np.int8))
+
+def parse_state(value):
+    if isinstance(value, str):
+        try:
+            return RunState[value].value
+        except KeyError:
+            raise ValueError("Unknown state '{}'".format(value)) from None
+    return RunState(int(value)).value
+
+def parse_fault(value):
+    # Fault codes are one byte in both reply packets
+    fault = int(value)
+    if not 0 <= fault <= 255:
+        raise ValueError("Fault code {} is out of range, expected 0 to 255".format(value))
+    return fault
+
+def parse_scenario(data, name="scenario"):
+    tracks = {}
+    for track_name, keyframes in data.get("tracks", {}).items():
+        if track_name not in TRACKS:
+            raise ValueError("Unknown track '{}', expected one of {}".format(track_name, ", ".join(TRACKS)))
+        tracks[track_name] = parse_track(track_name, keyframes)
+
+    state_events = []
+    fault_events = []
+    for event in data.get("events", []):
+        if "state" in event:
+            state_events.append((float(event["time"]), parse_state(event["state"])))
+        if "fault" in event:
+            fault_events.append((float(event["time"]), parse_fault(event["fault"])))
+    state_events.sort()
+    fault_events.sort()
+
+    ends = [track.times[-1] for track in tracks.values()]
+    ends += [event[0] for event in state_events + fault_events]
+    duration = float(data.get("duration", max(ends, default=0.0)))
+    if duration <= 0:
+        raise ValueError("Scenario has no duration")
+    rate = float(data.get("rate", 1000.0))
+    if not rate > 0:
+        raise ValueError("Scenario rate must be above 0")
+    return Scenario(data.get("name", name), rate, duration,
+                    bool(data.get("loop", False)), tracks, state_events, fault_events)
+
+def load_scenario(path):
+    name, extension = os.path.splitext(os.path.basename(path))
+    extension = extension.lower()
+    if extension == ".toml":
+        try:
+            import tomllib
+        except ImportError:
+            # Python before 3.11
+            try:
+                import tomli as tomllib
+            except ImportError:
+                raise ValueError("Python 3.11 or tomli is needed to load {}; use JSON instead".format(path)) from None
+        with open(path, "rb") as f:
+            data = tomllib.load(f)
+    elif extension in (".yaml", ".yml"):
+        try:
+            import yaml
+        except ImportError:
+            raise ValueError("PyYAML is needed to load {}; use JSON or TOML instead".format(path)) from None
+        with open(path) as f:
+            data = yaml.safe_load(f)
+    else:
+        with open(path) as f:
+            data = json.load(f)
+    return parse_scenario(data, name)
+
+def sample_track(track, t):
+    # All samples at once: find each sample's segment, then blend its end
+    # points according to the segment's interpolation
+    times = track.times
+    values = track.values
+    if len(times) == 1:
+        return np.full(len(t), values[0])
+    upper = np.clip(np.searchsorted(times, t, side="right"), 1, len(times) - 1)
+    lower = upper - 1
+    span = times[upper] - times[lower]
+    fraction = np.clip((t - times[lower]) / np.where(span > 0, span, 1.0), 0.0, 1.0)
+    modes = track.modes[upper]
+    fraction = np.where(modes == INTERPOLATIONS["step"], np.where(fraction >= 1.0, 1.0, 0.0), fraction)
+    fraction = np.where(modes == INTERPOLATIONS["smooth"], 0.5 - 0.5 * np.cos(np.pi * fraction), fraction)
+    return values[lower] + (values[upper] - values[lower]) * fraction
+
+def sample_events(events, t, initial):
+    out = np.full(len(t), initial, dtype=np.uint8)
+    for when, value in events:
+        out[t >= when] = value
+    return out
+
+def compile_scenario(scenario, params=None):
+    # Everything is worked out here, once; the model's tick only indexes
+    params = params if params is not None else DriveParameters()
+    count = max(1, int(round(scenario.duration * scenario.rate)))
+    t = np.arange(count, dtype=np.float64) / scenario.rate
+    samples = {}
+    for name in TRACKS:
+        if name in scenario.tracks:
+            samples[name] = sample_track(scenario.tracks[name], t)
+        elif name in DEFAULTS:
+            samples[name] = np.full(count, DEFAULTS[name])
+    # Without their own tracks the currents, duty cycle and temperatures
+    # come from the drivetrain model: the torque to follow the RPM track, at
+    # the voltage of the voltage track
+    rpm = samples["rpm"]
+    if "motor_current" not in samples:
+        accel = np.gradient(rpm, 1.0 / scenario.rate) if count > 1 else np.zeros(count)
+        samples["motor_current"] = motor_current(rpm, accel, params)
+    duty_cycle, input_current = motor_duty(rpm, samples["motor_current"], samples["voltage"], params)
+    samples.setdefault("duty_cycle", duty_cycle)
+    samples.setdefault("input_current", input_current)
+    if "temp_fet" not in samples or "temp_motor" not in samples:
+        temp_fet, temp_motor = ride_temperatures(samples["motor_current"], scenario.rate, params)
+        samples.setdefault("temp_fet", temp_fet)
+        samples.setdefault("temp_motor", temp_motor)
+    return RideProfile(
+        scenario.rate, samples["rpm"], samples["duty_cycle"], samples["motor_current"],
+        samples["input_current"], samples["voltage"], samples["temp_fet"], samples["temp_motor"],
+        state=sample_events(scenario.state_events, t, RunState.STATE_RUNNING.value),
+        fault=sample_events(scenario.fault_events, t, 0))
+
+def main():
+    parser = argparse.ArgumentParser(description="Check and compile scenario files")
+    parser.add_argument("scenarios", nargs="+", help="JSON, TOML or YAML scenario files")
+    args = parser.parse_args()
+
+    for path in args.scenarios:
+        scenario = load_scenario(path)
+        start = time.perf_counter()
+        profile = compile_scenario(scenario)
+        elapsed = time.perf_counter() - start
+        print("{}: {:.1f} s at {:.0f} Hz, {} tracks, {} state and {} fault events, compiled {} steps in {:.3f} s{}".format(
+            scenario.name, scenario.duration, scenario.rate, len(scenario.tracks),
+            len(scenario.state_events), len(scenario.fault_events), len(profile), elapsed,
+            ", looping" if scenario.loop else ""))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import math
+import time
+from dataclasses import dataclass, field
+
+MAX_RATE = 1000.0
+
+@dataclass
+class JitterStats:
+    # Lateness of each wake-up against its deadline, in seconds
+    wakeups: int = 0
+    steps: int = 0
+    late_wakeups: int = 0
+    dropped_steps: int = 0
+    mean: float = 0.0
+    max: float = 0.0
+    _m2: float = field(default=0.0, repr=False)
+
+    def record(self, lateness):
+        # Welford's running mean/variance
+        self.wakeups += 1
+        delta = lateness - self.mean
+        self.mean += delta / self.wakeups
+        self._m2 += delta * (lateness - self.mean)
+        if lateness > self.max:
+            self.max = lateness
+
+    @property
+    def stddev(self):
+        return math.sqrt(self._m2 / self.wakeups) if self.wakeups > 1 else 0.0
+
+    def __str__(self):
+        return ("wakeups={} steps={} late={} dropped={} jitter mean={:.1f}us "
+                "stddev={:.1f}us max={:.1f}us").format(
+            self.wakeups, self.steps, self.late_wakeups, self.dropped_steps,
+            self.mean * 1e6, self.stddev * 1e6, self.max * 1e6)
+
+class TickScheduler:
+    # Calls step(dt) at a fixed rate with a fixed dt. Deadlines are kept on the
+    # monotonic clock so sleep overshoot does not accumulate; if the caller
+    # falls behind, the missed steps are run back to back (up to max_catchup)
+    # and anything beyond that is dropped and counted.
+    def __init__(self, step, rate=100.0, max_catchup=10):
+        if not 0 < rate <= MAX_RATE:
+            raise ValueError("Tick rate must be in (0, {}] Hz".format(MAX_RATE))
+        self.step = step
+        self.rate = rate
+        self.dt = 1.0 / rate
+        self.max_catchup = max_catchup
+        self.stats = JitterStats()
+        self.next_deadline = None
+
+    def start(self, now=None):
+        now = time.monotonic() if now is None else now
+        self.next_deadline = now + self.dt
+
+    def poll(self, now=None):
+        # Run every step that is due and return the seconds until the next one
+        now = time.monotonic() if now is None else now
+        if self.next_deadline is None:
+            self.start(now)
+        lateness = now - self.next_deadline
+        if lateness < 0:
+            return -lateness
+
+        stats = self.stats
+        stats.record(lateness)
+        if lateness >= self.dt:
+            stats.late_wakeups += 1
+
+        dt = self.dt
+        due = int(lateness / dt) + 1
+        steps = min(due, self.max_catchup)
+        for _ in range(steps):
+            self.step(dt)
+        stats.steps += steps
+        stats.dropped_steps += due - steps
+        self.next_deadline += due * dt
+        return max(0.0, self.next_deadline - time.monotonic())
+
+    def run(self, stop_event):
+        self.start()
+        while not stop_event.is_set():
+            delay = self.poll()
+            if delay > 0:
+                time.sleep(delay)
@@ -0,0 +1,48 @@
+from capture import INBOUND, RAW, CaptureReader, CaptureWriter, CapturingDispatcher
+from dispatch import default_dispatcher
+from engine import SimulatorModel
+from fuzzer import Fuzzer, FuzzingDispatcher
+
+def replies(count):
+    # Valid replies that change from one poll to the next
+    model = SimulatorModel()
+    frames = []
+    for i in range(count):
+        model.set_rpm(i * 7 % 900)
+        model.set_voltage(40.0 + i % 30)
+        frames.append(bytes(model.snapshot.values_frame()))
+    return frames
+
+def test_same_seed_same_mutations():
+    frames = replies(600)
+    first = Fuzzer(1234, batch_size=64)
+    second = Fuzzer(1234, batch_size=64)
+    out = [first.mutate(0x04, frame) for frame in frames]
+    assert out == [second.mutate(0x04, frame) for frame in frames]
+    assert first.mutated == second.mutated > 0
+    assert out != [Fuzzer(4321, batch_size=64).mutate(0x04, frame) for frame in frames]
+
+def test_recipes_do_not_depend_on_the_replies():
+    # The n-th reply gets the n-th recipe whatever the replies were before
+    frames = replies(300)
+    first = Fuzzer(99, strategies=["corrupt_crc"])
+    second = Fuzzer(99, strategies=["corrupt_crc"])
+    for frame in frames[:200]:
+        first.mutate(0x04, frame)
+    for frame in reversed(frames[:200]):
+        second.mutate(0x04, frame)
+    assert [first.mutate(0x04, frame) for frame in frames[200:]] == \
+        [second.mutate(0x04, frame) for frame in frames[200:]]
+
+def test_capture_records_fuzzed_bytes(tmp_path):
+    path = str(tmp_path / "fuzz.cap")
+    writer = CaptureWriter(path)
+    dispatcher = CapturingDispatcher(FuzzingDispatcher(default_dispatcher, Fuzzer(7)), writer, raw=True)
+    model = SimulatorModel()
+    sent = [bytes(dispatcher.dispatch(model, b"\x04")) for _ in range(20)]
+    writer.close()
+    reader = CaptureReader(path)
+    records = [(direction, bytes(payload)) for _, direction, payload in reader]
+    reader.close()
+    assert [payload for direction, payload in records if direction == RAW] == sent
+    assert sum(direction == INBOUND for direction, _ in records) == 20
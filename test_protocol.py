@@ -0,0 +1,106 @@
+import struct
+
+import pytest
+
+from commands import (CHARGESTATE, CHARGESTATE_MAGIC, COMM_CUSTOM_APP_DATA, FLOAT_COMMAND_CHARGESTATE,
+                      FLOAT_COMMAND_LCM_POLL, FLOAT_PACKAGE_ID, ChargeState, GetValues, LcmPoll,
+                      UnknownCommand, decode_command)
+from engine import default_lcm_poll_response, default_values
+from packets import COMM_CUSTOM_APP_DATA as LcmPollReply
+from packets import COMM_GET_VALUES as ValuesReply
+from packets import parse_reply
+from protocol import FrameDecoder, encode_frame
+
+def test_values_round_trip():
+    packet = default_values()
+    packet.assign(("rpm", "voltage_filtered", "avg_motor_current", "amp_hours", "tachometer", "fault"),
+                  (-321.0, 58.4, 12.34, 1.2345, 4567.0, 3))
+    reply = parse_reply(packet.frame_values(packet.field_values()))
+    assert isinstance(reply, ValuesReply)
+    assert reply.rpm == -321.0
+    assert reply.voltage_filtered == pytest.approx(58.4)
+    assert reply.avg_motor_current == pytest.approx(12.34)
+    assert reply.amp_hours == pytest.approx(1.2345)
+    assert reply.tachometer == 4567.0
+    assert reply.fault == 3
+
+def test_lcm_poll_round_trip():
+    packet = default_lcm_poll_response()
+    packet.assign(("state", "fault", "pitch_or_duty_cycle", "rpm", "avgInputCurrent", "inpVoltage"),
+                  (2, 7, 0.5, 850.0, -4.25, 61.2))
+    reply = parse_reply(packet.frame_values(packet.field_values()))
+    assert isinstance(reply, LcmPollReply)
+    assert (reply.state, reply.fault) == (2, 7)
+    assert reply.pitch_or_duty_cycle == pytest.approx(0.5)
+    assert reply.rpm == pytest.approx(850.0)
+    assert reply.avgInputCurrent == pytest.approx(-4.25)
+    assert reply.inpVoltage == pytest.approx(61.2)
+
+def test_parse_reply_rejects_bad_frames():
+    frame = default_values().frame_values(default_values().field_values())
+    corrupt = bytearray(frame)
+    corrupt[5] ^= 0xff
+    assert parse_reply(corrupt) is None
+    assert parse_reply(frame[:-1]) is None
+    assert parse_reply(encode_frame(b"\x04\x00")) is None
+
+def test_decoder_split_reads():
+    decoder = FrameDecoder()
+    data = bytes(encode_frame(b"\x04")) + bytes(encode_frame(b"\x24\x65\x18"))
+    frames = []
+    for i in range(len(data)):
+        frames += decoder.feed(data[i:i + 1])
+    assert frames == [b"\x04", b"\x24\x65\x18"]
+    assert decoder.stats.frames_decoded == 2
+    assert decoder.stats.resync_bytes == 0
+    assert not decoder.buffer
+
+def test_decoder_resync():
+    decoder = FrameDecoder()
+    # Line noise, a stray start byte with a zero length and a bad end byte
+    # before a good frame
+    frame = bytes(encode_frame(b"\x04"))
+    bad_end = frame[:-1] + b"\x00"
+    assert decoder.feed(b"\xff\x55" + b"\x02\x00" + bad_end + frame) == [b"\x04"]
+    stats = decoder.stats
+    assert stats.bad_lengths == 1
+    assert stats.bad_end_bytes == 1
+    assert stats.resync_bytes == 2 + 2 + len(bad_end)
+    assert stats.frames_decoded == 1
+
+def test_decoder_crc_failure():
+    decoder = FrameDecoder()
+    corrupt = bytearray(encode_frame(b"\x04"))
+    corrupt[2] ^= 0x01
+    assert decoder.feed(bytes(corrupt) + bytes(encode_frame(b"\x04"))) == [b"\x04"]
+    assert decoder.stats.crc_failures == 1
+    assert decoder.stats.frames_decoded == 1
+
+def test_decoder_survives_kept_views():
+    decoder = FrameDecoder()
+    data = bytes(encode_frame(b"\x04")) + bytes(encode_frame(b"\x24\x65\x18"))
+    kept = []
+    for _ in range(3):
+        for frame in decoder.frames(data):
+            kept.append(frame[0:1])
+    assert [bytes(view) for view in kept] == [b"\x04", b"\x24"] * 3
+    assert decoder.stats.frames_decoded == 6
+    assert decoder.stats.buffer_copies > 0
+
+def test_decode_command():
+    assert decode_command(b"\x04") == GetValues()
+    assert decode_command(bytes([COMM_CUSTOM_APP_DATA, FLOAT_PACKAGE_ID, FLOAT_COMMAND_LCM_POLL])) == LcmPoll()
+    assert decode_command(b"\x99") == UnknownCommand(0x99)
+    assert decode_command(bytes([COMM_CUSTOM_APP_DATA, FLOAT_PACKAGE_ID, 0x42])) == \
+        UnknownCommand(COMM_CUSTOM_APP_DATA, FLOAT_PACKAGE_ID, 0x42)
+    with pytest.raises(ValueError):
+        decode_command(b"")
+
+def test_decode_charge_state():
+    header = bytes([COMM_CUSTOM_APP_DATA, FLOAT_PACKAGE_ID, FLOAT_COMMAND_CHARGESTATE])
+    frame = memoryview(header + CHARGESTATE.pack(CHARGESTATE_MAGIC, 1, 25, 584))
+    assert decode_command(frame) == ChargeState(True, 2.5, 58.4)
+    with pytest.raises(ValueError):
+        decode_command(header + CHARGESTATE.pack(0, 1, 25, 584))
+    with pytest.raises(ValueError):
+        decode_command(header + struct.pack(">B", CHARGESTATE_MAGIC))
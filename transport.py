@@ -0,0 +1,257 @@
+import argparse
+import asyncio
+import os
+
+import serial
+
+from dispatch import default_dispatcher
+from engine import SimulatorModel
+from fleet import PtyLink
+from protocol import FrameDecoder, ReplyWriter
+from scheduler import MAX_RATE, TickScheduler
+
+READ_SIZE = 4096
+# Reconnect back-off: retry quickly at first, slow down while the port stays away
+RECONNECT_MIN = 0.05
+RECONNECT_MAX = 5.0
+
+class VescProtocol(asyncio.Protocol):
+    # Answers VESC requests for one model over any asyncio transport
+    def __init__(self, model, dispatcher=default_dispatcher, metrics=None):
+        self.model = model
+        self.dispatcher = dispatcher
+        self.metrics = metrics
+        self.decoder = FrameDecoder()
+        self.transport = None
+        self.writer = None
+        self.lost = asyncio.Event()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        # Some transports keep a reference to unsent data, so they get a copy
+        # rather than a view of the reused reply buffer
+        self.writer = ReplyWriter(lambda data: transport.write(bytes(data)))
+
+    def data_received(self, data):
+        if self.metrics is not None:
+            self.metrics.handle(data, self.decoder, self.model, self.dispatcher, self.writer)
+            return
+        for frame in self.decoder.frames(data):
+            reply = self.dispatcher.dispatch(self.model, frame)
+            if reply:
+                self.writer.add(reply)
+        self.writer.send()
+
+    def connection_lost(self, exc):
+        if exc is not None:
+            print("Connection lost: ", exc)
+        self.lost.set()
+
+class FdTransport(asyncio.Transport):
+    # Non-blocking transport over a POSIX file descriptor (serial device or
+    # pty master), driven by the event loop's reader/writer callbacks
+    def __init__(self, loop, fd, protocol, owner=None, extra=None):
+        super().__init__(extra)
+        self._loop = loop
+        self._fd = fd
+        self._protocol = protocol
+        self._owner = owner
+        self._buffer = bytearray()
+        self._closing = False
+        self._lost = False
+        os.set_blocking(fd, False)
+        loop.add_reader(fd, self._read_ready)
+        loop.call_soon(protocol.connection_made, self)
+
+    def _read_ready(self):
+        try:
+            data = os.read(self._fd, READ_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            self._fatal(exc)
+            return
+        if not data:
+            # Hang-up: the device went away
+            self._fatal(None)
+            return
+        self._protocol.data_received(data)
+
+    def write(self, data):
+        if self._closing or self._lost:
+            return
+        if not self._buffer:
+            try:
+                written = os.write(self._fd, data)
+            except (BlockingIOError, InterruptedError):
+                written = 0
+            except OSError as exc:
+                self._fatal(exc)
+                return
+            if written == len(data):
+                return
+            data = memoryview(data)[written:]
+            self._loop.add_writer(self._fd, self._write_ready)
+        self._buffer += data
+
+    def _write_ready(self):
+        try:
+            written = os.write(self._fd, self._buffer)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as exc:
+            self._fatal(exc)
+            return
+        del self._buffer[:written]
+        if not self._buffer:
+            self._loop.remove_writer(self._fd)
+            if self._closing:
+                self._connection_lost(None)
+
+    def get_write_buffer_size(self):
+        return len(self._buffer)
+
+    def is_closing(self):
+        return self._closing
+
+    def close(self):
+        if self._closing:
+            return
+        self._closing = True
+        self._loop.remove_reader(self._fd)
+        if not self._buffer:
+            self._connection_lost(None)
+
+    def abort(self):
+        self._fatal(None)
+
+    def _fatal(self, exc):
+        self._closing = True
+        self._buffer.clear()
+        self._loop.remove_writer(self._fd)
+        self._loop.remove_reader(self._fd)
+        self._connection_lost(exc)
+
+    def _connection_lost(self, exc):
+        if self._lost:
+            return
+        self._lost = True
+        self._loop.call_soon(self._protocol.connection_lost, exc)
+        if self._owner is not None:
+            self._owner.close()
+
+async def serve_serial(model, port, baudrate=115200, dispatcher=default_dispatcher, metrics=None):
+    # Keep a protocol attached to the port, reopening it as soon as a
+    # long-lived connection is lost; failed opens and connections that drop
+    # at once are retried with a doubling backoff
+    loop = asyncio.get_running_loop()
+    backoff = RECONNECT_MIN
+    while True:
+        try:
+            ser = serial.Serial(port, baudrate, timeout=0)
+        except (serial.SerialException, OSError) as e:
+            print("Serial port error: ", e)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, RECONNECT_MAX)
+            continue
+        protocol = VescProtocol(model, dispatcher, metrics)
+        connected_at = loop.time()
+        FdTransport(loop, ser.fileno(), protocol, owner=ser, extra={"serial": ser})
+        await protocol.lost.wait()
+        if loop.time() - connected_at > 1.0:
+            backoff = RECONNECT_MIN
+            print("Serial port closed, reconnecting")
+            continue
+        # Dropped straight away, e.g. a port that hangs up as soon as it is
+        # opened: back off as if the open had failed
+        print("Serial port closed, reconnecting in {:.1f} s".format(backoff))
+        await asyncio.sleep(backoff)
+        backoff = min(backoff * 2, RECONNECT_MAX)
+
+async def serve_tcp(model, host, port, dispatcher=default_dispatcher, metrics=None):
+    loop = asyncio.get_running_loop()
+    return await loop.create_server(lambda: VescProtocol(model, dispatcher, metrics), host, port)
+
+def serve_pty(model, dispatcher=default_dispatcher, metrics=None):
+    # Returns the slave device name for the firmware or harness to open
+    loop = asyncio.get_running_loop()
+    link = PtyLink()
+    FdTransport(loop, link.master_fd, VescProtocol(model, dispatcher, metrics), owner=link)
+    return link.slave_name
+
+async def tick_task(scheduler):
+    scheduler.start()
+    while True:
+        await asyncio.sleep(scheduler.poll())
+
+def parse_address(address):
+    host, _, port = address.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+async def serve(model, ports=(), tcp=(), pty=0, stop_event=None, tick_rate=None,
+                dispatcher=default_dispatcher, metrics=None, baudrate=115200):
+    tasks = [asyncio.create_task(serve_serial(model, port, baudrate, dispatcher, metrics)) for port in ports]
+    servers = []
+    for address in tcp:
+        host, port = parse_address(address)
+        servers.append(await serve_tcp(model, host, port, dispatcher, metrics))
+        print("Listening on {}:{}".format(host, port))
+    for _ in range(pty):
+        print("Serving on", serve_pty(model, dispatcher, metrics))
+    if tick_rate:
+        tasks.append(asyncio.create_task(tick_task(TickScheduler(model.tick, tick_rate))))
+
+    try:
+        if stop_event is not None:
+            # Stopped from another thread (e.g. the GUI closing)
+            await asyncio.get_running_loop().run_in_executor(None, stop_event.wait)
+        else:
+            await asyncio.Event().wait()
+    finally:
+        for task in tasks:
+            task.cancel()
+        for server in servers:
+            server.close()
+
+def run(model, ports=(), tcp=(), pty=0, stop_event=None, tick_rate=None, dispatcher=default_dispatcher,
+        metrics=None, baudrate=115200):
+    asyncio.run(serve(model, ports, tcp, pty, stop_event, tick_rate, dispatcher, metrics, baudrate))
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve a simulated VESC over asyncio transports")
+    parser.add_argument("-p", "--port", help="serial port to serve (may be repeated)",
+                        action="append", default=[])
+    parser.add_argument("--tcp", help="HOST:PORT to listen on (may be repeated)",
+                        action="append", default=[])
+    parser.add_argument("--pty", help="number of pseudo-terminals to serve",
+                        type=int, default=0)
+    parser.add_argument("--tick-rate", help="model ticks per second (up to 1000)",
+                        type=float, default=100.0)
+    parser.add_argument("-f", "--fuzz", help="send mutated COMM_GET_VALUES and COMM_CUSTOM_APP_DATA replies",
+                        action="store_true", default=False)
+    parser.add_argument("--fuzz-seed", help="seed for the fuzzer, to repeat a run",
+                        type=int, default=None)
+    args = parser.parse_args(argv)
+    if not 0 < args.tick_rate <= MAX_RATE:
+        parser.error("--tick-rate must be above 0 and at most {:.0f}".format(MAX_RATE))
+
+    fuzzing = None
+    try:
+        model = SimulatorModel()
+        dispatcher = default_dispatcher
+        if args.fuzz:
+            from fuzzer import Fuzzer, FuzzingDispatcher
+            fuzzer = Fuzzer(args.fuzz_seed)
+            print("Fuzzing with seed", fuzzer.seed)
+            dispatcher = fuzzing = FuzzingDispatcher(dispatcher, fuzzer)
+        run(model, args.port, args.tcp, args.pty, tick_rate=args.tick_rate, dispatcher=dispatcher)
+    except KeyboardInterrupt:
+        pass
+    if fuzzing is not None:
+        # Saves a stall at the very end of the run to the crash directory
+        fuzzing.check()
+        print("Fuzzer: seed={} mutated={} batches={} stalls={}".format(
+            fuzzer.seed, fuzzer.mutated, fuzzer.batches_generated, len(fuzzing.crashes)))
+
+if __name__ == "__main__":
+    main()